@@ -1,47 +1,19 @@
 # app.py
-from flask import Flask, jsonify
-from flask_migrate import Migrate
-from flask_jwt_extended import JWTManager
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask import Flask, jsonify, g
 from werkzeug.middleware.proxy_fix import ProxyFix
-from sqlalchemy import text
+from sqlalchemy import text, select, exists, literal, delete
 from datetime import timedelta, datetime, timezone
 import os
+import threading
 
-from models import db, User, TokenBlockList
+import click
+from cachetools import TTLCache, cached
 
-app = Flask(__name__)
+from extensions import db, migrate, jwt, limiter, mail
+from models import User, TokenBlockList
+from utils import auth_cache
+from utils.json_provider import OrjsonProvider
 
-# --- Core config ---
-DATABASE_URI = os.getenv("DATABASE_URI")
-if not DATABASE_URI:
-    raise RuntimeError("DATABASE_URI is missing")
-
-app.config.update(
-    SQLALCHEMY_DATABASE_URI=DATABASE_URI,
-    SQLALCHEMY_TRACK_MODIFICATIONS=False,
-    SECRET_KEY=os.getenv("SECRET_KEY", "change-me"),            # set in prod
-    JWT_SECRET_KEY=os.getenv("JWT_SECRET_KEY", "change-me-too"),# set in prod
-    JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=8),                # 8h session
-    PROPAGATE_EXCEPTIONS=True,
-)
-
-# Trust upstream proxy for client IP / scheme / host
-app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
-
-# --- Extensions ---
-db.init_app(app)
-migrate = Migrate(app, db)
-
-jwt = JWTManager(app)
-
-# Limiter (use Redis in prod: e.g. redis://redis:6379/0)
-limiter = Limiter(
-    key_func=get_remote_address,
-    storage_uri=os.getenv("RATELIMIT_STORAGE_URI", "memory://"),
-)
-limiter.init_app(app)
 
 # --- JWT blocklist & error handlers ------------------------------------------
 @jwt.token_in_blocklist_loader
@@ -53,33 +25,68 @@ def is_token_revoked(jwt_header, jwt_payload):
     - (Optional) If you later add user.token_invalid_after to hard-kill older tokens
     """
     try:
-        # 1) Explicit logout via TokenBlockList
         jti = jwt_payload.get("jti")
-        if jti and db.session.query(TokenBlockList.id).filter_by(jti=jti).first():
-            return True
-
-        # 2) Deactivated / missing user → reject immediately
         sub = jwt_payload.get("sub")
         user_id = int(sub) if sub is not None else None
-        user = db.session.get(User, user_id) if user_id is not None else None
-        if not user or not user.is_active:
+        if user_id is None:
+            return True
+
+        # Hot path: verdict cached in-process (L1) or in Redis (L2), either way
+        verdict = auth_cache.cached_verdict(jti, user_id)
+        if verdict is not None:
+            return verdict
+
+        # One round-trip: user row + blocklist membership (explicit logout).
+        # The loaded User is handed to load_user() below via g (no second SELECT).
+        blocked = exists().where(TokenBlockList.jti == jti) if jti else literal(False)
+        row = db.session.execute(
+            select(User, blocked.label("blocked")).where(User.id == user_id)
+        ).first()
+
+        # Deactivated / missing user or logged-out token → reject
+        if row is not None and row.blocked:
+            auth_cache.forget(jti, jwt_payload.get("exp"))   # revoked for good: skip the DB next time
+            return True
+        if row is None or not row.User.is_active:
             return True
 
-        # 3) Optional "token_invalid_after" support
+        # Optional "token_invalid_after" support
         # If you add a DateTime column on User and set it when you deactivate/reactivate,
         # this will invalidate any token issued before that timestamp.
-        if getattr(user, "token_invalid_after", None):
+        invalid_after = getattr(row.User, "token_invalid_after", None)
+        if invalid_after:
             iat = jwt_payload.get("iat")
             if iat:
                 issued_at = datetime.fromtimestamp(iat, tz=timezone.utc)
-                if issued_at < user.token_invalid_after.replace(tzinfo=timezone.utc):
+                if issued_at < invalid_after.replace(tzinfo=timezone.utc):
                     return True
 
+        # Strong ref for load_user(): the session identity map alone is weak-referenced
+        g._jwt_checked_user = row.User
+        auth_cache.remember_good(jti, user_id)
         return False
     except Exception:
         # Fail closed on unexpected errors
         return True
 
+@jwt.user_lookup_loader
+def load_user(jwt_header, jwt_payload):
+    """
+    Backs flask_jwt_extended.current_user / get_current_user(): one load per request.
+    Runs on every protected request, so it also rejects deactivated users even when
+    the revocation check above was answered from cache (None → 401).
+    """
+    user = g.pop("_jwt_checked_user", None)
+    if user is None:
+        user = db.session.get(User, int(jwt_payload["sub"]))
+    if user is None or not user.is_active:
+        return None
+    return user
+
+@jwt.user_lookup_error_loader
+def user_lookup_error_callback(jwt_header, jwt_payload):
+    return jsonify({"error": "User not found"}), 401
+
 @jwt.revoked_token_loader
 def revoked_token_callback(jwt_header, jwt_payload):
     return jsonify({"error": "Token has been revoked"}), 401
@@ -96,27 +103,130 @@ def invalid_token_callback(reason):
 def missing_token_callback(reason):
     return jsonify({"error": "Missing or invalid authorization", "details": reason}), 401
 
-# --- Blueprints (import after limiter/JWT are set) ----------------------------
-from views.auth import auth_bp
-from views.users import user_bp
-from views.packaging import packaging_bp
-from views.sale import retail_bp
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(user_bp)
-app.register_blueprint(packaging_bp)
-app.register_blueprint(retail_bp)
-
-# --- Misc routes --------------------------------------------------------------
-@app.get("/")
-def home():
-    return "App is running"
-
-@app.get("/health")
-def health():
+
+# --- Readiness probe -----------------------------------------------------------
+# Probes fire every few seconds per replica; one real SELECT 1 per 2s is plenty.
+# Only success is cached (exceptions propagate), so an outage shows up at once.
+@cached(TTLCache(maxsize=1, ttl=2), lock=threading.Lock())
+def _db_up() -> bool:
     db.session.execute(text("SELECT 1"))
-    return {"status": "ok", "db": "up"}, 200
+    return True
+
+
+# --- Blueprints (import after limiter/JWT are set) ----------------------------
+def _register_blueprints(app):
+    from views.auth import auth_bp
+    from views.users import user_bp
+    from views.packaging import packaging_bp
+    from views.sale import retail_bp
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(user_bp)
+    app.register_blueprint(packaging_bp)
+    app.register_blueprint(retail_bp)
+
+
+# --- Engine / pool -------------------------------------------------------------
+def _engine_options(uri: str) -> dict:
+    """Pool settings (env-tunable). Sizing only applies to server DBs, not SQLite."""
+    opts = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if not uri.startswith("sqlite"):
+        opts.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        )
+    return opts
+
+
+# --- Factory ------------------------------------------------------------------
+def create_app(config: dict | None = None) -> Flask:
+    """Build the app; every extension is init'd exactly once here."""
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+
+    # --- Core config ---
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URI"),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY=os.getenv("SECRET_KEY", "change-me"),            # set in prod
+        JWT_SECRET_KEY=os.getenv("JWT_SECRET_KEY", "change-me-too"),# set in prod
+        JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=8),                # 8h session
+        PROPAGATE_EXCEPTIONS=True,
+
+        # Mail (Flask-Mail reads these at init_app)
+        MAIL_SERVER=os.getenv("MAIL_SERVER", "localhost"),
+        MAIL_PORT=int(os.getenv("MAIL_PORT", "587")),
+        MAIL_USE_TLS=os.getenv("MAIL_USE_TLS", "true").lower() == "true",
+        MAIL_USE_SSL=os.getenv("MAIL_USE_SSL", "false").lower() == "true",
+        MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
+        MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
+        MAIL_DEFAULT_SENDER=os.getenv("MAIL_DEFAULT_SENDER") or os.getenv("MAIL_USERNAME"),
+        MAIL_MAX_EMAILS=int(os.getenv("MAIL_MAX_EMAILS", "50")),   # reconnect after N sends per session
+    )
+    if config:
+        app.config.update(config)
+
+    # WARNING in prod keeps debug/info calls from even formatting their args
+    if os.getenv("LOGGING_LEVEL"):
+        app.logger.setLevel(os.getenv("LOGGING_LEVEL").upper())
+
+    if not app.config.get("SQLALCHEMY_DATABASE_URI"):
+        raise RuntimeError("DATABASE_URI is missing")
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", _engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+
+    # Trust upstream proxy for client IP / scheme / host
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
+
+    # --- Extensions ---
+    db.init_app(app)
+    migrate.init_app(app, db)
+    jwt.init_app(app)
+    limiter.init_app(app)
+    mail.init_app(app)
+
+    # --- Misc routes ---
+    @app.get("/")
+    def home():
+        return "App is running"
+
+    live_body = app.json.dumps({"status": "ok"}).encode()   # constant: encode once
+
+    @app.get("/live")
+    def live():
+        return app.response_class(live_body, mimetype="application/json")
+
+    @app.get("/ready")
+    @app.get("/health")            # kept for existing probes
+    def ready():
+        try:
+            _db_up()
+        except Exception:
+            db.session.rollback()
+            return {"status": "unavailable", "db": "down"}, 503
+        return {"status": "ok", "db": "up"}, 200
+
+    # --- CLI ---
+    @app.cli.command("purge-blocklist")
+    def purge_blocklist():
+        """Delete blocklist rows older than the token lifetime (run hourly from cron)."""
+        cutoff = datetime.utcnow() - app.config["JWT_ACCESS_TOKEN_EXPIRES"]
+        result = db.session.execute(delete(TokenBlockList).where(TokenBlockList.created_at < cutoff))
+        db.session.commit()
+        click.echo(f"Purged {result.rowcount} expired blocklist rows")
+
+    # CLI paths that need no routes (e.g. `FLASK_SKIP_BLUEPRINTS=1 flask db upgrade`)
+    # skip importing the view modules entirely.
+    if not os.getenv("FLASK_SKIP_BLUEPRINTS"):
+        _register_blueprints(app)
+
+    return app
+
 
 # --- Entrypoint ---------------------------------------------------------------
+# gunicorn "app:create_app()"  |  flask (auto-detects create_app)
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=os.getenv("FLASK_DEBUG", "false").lower() == "true")
+    create_app().run(host="0.0.0.0", debug=os.getenv("FLASK_DEBUG", "false").lower() == "true")
@@ -1,3 +1,24 @@
+# extensions.py
+# Extension singletons. Created unbound here and init_app()'d once in app.create_app(),
+# so views/utils can import them without importing the app module.
+from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
+from flask_jwt_extended import JWTManager
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from flask_mail import Mail
+import os
 
+db = SQLAlchemy()
+migrate = Migrate()
+jwt = JWTManager()
 mail = Mail()
+
+# Limiter (use Redis in prod: e.g. redis://redis:6379/0 so all workers share counters)
+# moving-window = sliding log; on Redis it is a single atomic Lua script per hit,
+# and it does not allow the 2x burst a fixed window permits at the boundary.
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI", "memory://"),
+    strategy=os.getenv("RATELIMIT_STRATEGY", "moving-window"),
+)
@@ -0,0 +1,29 @@
+"""device_approval_requests pending partial index
+
+Revision ID: 3c8d2f71b6e4
+Revises: e6b04c9f7a13
+Create Date: 2026-10-15 23:02:17.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8d2f71b6e4'
+down_revision = 'e6b04c9f7a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Same predicate as the model (renders 'is_resolved = false' on PostgreSQL, '= 0' on SQLite)
+    pending = sa.column('is_resolved', sa.Boolean()) == False  # noqa: E712
+    with op.batch_alter_table('device_approval_requests', schema=None) as batch_op:
+        batch_op.create_index('ix_device_approval_requests_pending', ['user_id', 'created_at'], unique=False,
+                              postgresql_where=pending, sqlite_where=pending)
+
+
+def downgrade():
+    with op.batch_alter_table('device_approval_requests', schema=None) as batch_op:
+        batch_op.drop_index('ix_device_approval_requests_pending')
@@ -0,0 +1,40 @@
+"""composite indexes for report filters
+
+Revision ID: 3f9a2c7d41e8
+Revises: 69db152a0dc6
+Create Date: 2026-10-15 09:12:04.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c7d41e8'
+down_revision = '69db152a0dc6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('retail_sale', schema=None) as batch_op:
+        batch_op.create_index('ix_retail_sale_active_date', ['is_deleted', 'date'], unique=False)
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.create_index('ix_expense_active_date', ['is_deleted', 'date'], unique=False)
+
+    with op.batch_alter_table('retail_sale_item', schema=None) as batch_op:
+        batch_op.create_index('ix_rsi_sale_bottle', ['sale_id', 'bottle_size_id'], unique=False)
+        batch_op.drop_index('ix_rsi_sale_id')
+
+
+def downgrade():
+    with op.batch_alter_table('retail_sale_item', schema=None) as batch_op:
+        batch_op.create_index('ix_rsi_sale_id', ['sale_id'], unique=False)
+        batch_op.drop_index('ix_rsi_sale_bottle')
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.drop_index('ix_expense_active_date')
+
+    with op.batch_alter_table('retail_sale', schema=None) as batch_op:
+        batch_op.drop_index('ix_retail_sale_active_date')
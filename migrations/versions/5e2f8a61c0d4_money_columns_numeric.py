@@ -0,0 +1,52 @@
+"""money columns Float -> Numeric(12, 2)
+
+Revision ID: 5e2f8a61c0d4
+Revises: d47c90b3e615
+Create Date: 2026-10-15 11:08:52.417306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2f8a61c0d4'
+down_revision = 'd47c90b3e615'
+branch_labels = None
+depends_on = None
+
+
+MONEY_COLUMNS = [
+    ('bottle_size', 'selling_price'),
+    ('bottle_size', 'cost_price_carton'),
+    ('retail_sale', 'total_amount'),
+    ('retail_sale', 'paid_amount'),
+    ('retail_sale', 'balance_due'),
+    ('retail_sale_item', 'unit_price'),
+    ('retail_sale_item', 'total_price'),
+    ('retail_sale_item', 'cogs_unit_price'),
+    ('retail_sale_item', 'cogs_total'),
+    ('customer_payment', 'amount'),
+    ('expense', 'amount'),
+]
+
+
+def _alter(from_type, to_type, pg_using):
+    is_pg = op.get_bind().dialect.name == 'postgresql'
+    tables = {}
+    for table, column in MONEY_COLUMNS:
+        tables.setdefault(table, []).append(column)
+
+    for table, columns in tables.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                kw = {'postgresql_using': pg_using.format(column=column)} if is_pg else {}
+                batch_op.alter_column(column, existing_type=from_type, type_=to_type, **kw)
+
+
+def upgrade():
+    _alter(sa.Float(), sa.Numeric(precision=12, scale=2), 'round({column}::numeric, 2)')
+
+
+def downgrade():
+    _alter(sa.Numeric(precision=12, scale=2), sa.Float(), '{column}::double precision')
@@ -0,0 +1,26 @@
+"""users lower(email) index
+
+Revision ID: 7a4e19c3d852
+Revises: 3c8d2f71b6e4
+Create Date: 2026-10-15 23:24:51.730942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4e19c3d852'
+down_revision = '3c8d2f71b6e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_email_lower', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_email_lower')
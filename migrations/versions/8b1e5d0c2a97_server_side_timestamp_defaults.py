@@ -0,0 +1,44 @@
+"""server-side timestamp defaults
+
+Revision ID: 8b1e5d0c2a97
+Revises: 3f9a2c7d41e8
+Create Date: 2026-10-15 10:02:47.113905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e5d0c2a97'
+down_revision = '3f9a2c7d41e8'
+branch_labels = None
+depends_on = None
+
+# (table, column) pairs that get a DB-side UTC "now" default
+COLUMNS = [
+    ('users', 'created_at'),
+    ('retail_sale', 'date'),
+    ('customer_payment', 'date'),
+    ('stock_balance', 'updated_at'),
+    ('token_blocklist', 'created_at'),
+]
+
+
+def _utcnow():
+    if op.get_bind().dialect.name == 'postgresql':
+        return sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
+    return sa.text('CURRENT_TIMESTAMP')
+
+
+def upgrade():
+    default = _utcnow()
+    for table, column in COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.DateTime(), server_default=default)
+
+
+def downgrade():
+    for table, column in COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, existing_type=sa.DateTime(), server_default=None)
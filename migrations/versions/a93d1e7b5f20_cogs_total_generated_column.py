@@ -0,0 +1,44 @@
+"""cogs_total as a stored generated column
+
+Revision ID: a93d1e7b5f20
+Revises: 5e2f8a61c0d4
+Create Date: 2026-10-15 11:42:07.861930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93d1e7b5f20'
+down_revision = '5e2f8a61c0d4'
+branch_labels = None
+depends_on = None
+
+
+COGS_TOTAL_EXPR = 'quantity * COALESCE(cogs_unit_price, 0)'
+
+
+def _recreate():
+    # SQLite can only ADD stored generated columns by rebuilding the table;
+    # PostgreSQL adds/drops them with plain ALTER TABLE (no copy of the table).
+    return 'always' if op.get_bind().dialect.name == 'sqlite' else 'auto'
+
+
+def upgrade():
+    # A column cannot be converted to GENERATED in place; drop and re-add it.
+    with op.batch_alter_table('retail_sale_item', schema=None, recreate=_recreate()) as batch_op:
+        batch_op.drop_column('cogs_total')
+    with op.batch_alter_table('retail_sale_item', schema=None, recreate=_recreate()) as batch_op:
+        batch_op.add_column(sa.Column(
+            'cogs_total', sa.Numeric(precision=12, scale=2),
+            sa.Computed(COGS_TOTAL_EXPR, persisted=True),
+        ))
+
+
+def downgrade():
+    with op.batch_alter_table('retail_sale_item', schema=None, recreate=_recreate()) as batch_op:
+        batch_op.drop_column('cogs_total')
+    with op.batch_alter_table('retail_sale_item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cogs_total', sa.Numeric(precision=12, scale=2), nullable=True))
+    op.execute(f'UPDATE retail_sale_item SET cogs_total = {COGS_TOTAL_EXPR}')
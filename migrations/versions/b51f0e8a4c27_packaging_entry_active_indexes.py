@@ -0,0 +1,32 @@
+"""packaging_entry active-row list indexes
+
+Revision ID: b51f0e8a4c27
+Revises: 7a4e19c3d852
+Create Date: 2026-10-15 23:41:08.264519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b51f0e8a4c27'
+down_revision = '7a4e19c3d852'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Same predicate as the model (renders 'is_deleted = false' on PostgreSQL, '= 0' on SQLite)
+    active = sa.column('is_deleted', sa.Boolean()) == False  # noqa: E712
+    with op.batch_alter_table('packaging_entry', schema=None) as batch_op:
+        batch_op.create_index('ix_packaging_entry_active_date', ['date', 'id'], unique=False,
+                              postgresql_where=active, sqlite_where=active)
+        batch_op.create_index('ix_packaging_entry_active_size_date', ['bottle_size_id', 'date', 'id'], unique=False,
+                              postgresql_where=active, sqlite_where=active)
+
+
+def downgrade():
+    with op.batch_alter_table('packaging_entry', schema=None) as batch_op:
+        batch_op.drop_index('ix_packaging_entry_active_size_date')
+        batch_op.drop_index('ix_packaging_entry_active_date')
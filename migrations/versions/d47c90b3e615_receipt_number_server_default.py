@@ -0,0 +1,32 @@
+"""receipt_number server default
+
+Revision ID: d47c90b3e615
+Revises: 8b1e5d0c2a97
+Create Date: 2026-10-15 10:41:19.302554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd47c90b3e615'
+down_revision = '8b1e5d0c2a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pgcrypto')
+        default = sa.text("('R-' || upper(substr(replace(gen_random_uuid()::text, '-', ''), 1, 8)))")
+    else:
+        default = sa.text("('R-' || upper(hex(randomblob(4))))")
+
+    with op.batch_alter_table('retail_sale', schema=None) as batch_op:
+        batch_op.alter_column('receipt_number', existing_type=sa.String(length=50), server_default=default)
+
+
+def downgrade():
+    with op.batch_alter_table('retail_sale', schema=None) as batch_op:
+        batch_op.alter_column('receipt_number', existing_type=sa.String(length=50), server_default=None)
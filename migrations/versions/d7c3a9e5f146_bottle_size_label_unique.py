@@ -0,0 +1,27 @@
+"""bottle_size.label unique
+
+Revision ID: d7c3a9e5f146
+Revises: b51f0e8a4c27
+Create Date: 2026-10-15 23:58:42.917306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7c3a9e5f146'
+down_revision = 'b51f0e8a4c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fails if duplicate labels already exist; merge those rows first.
+    with op.batch_alter_table('bottle_size', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_bottle_size_label', ['label'])
+
+
+def downgrade():
+    with op.batch_alter_table('bottle_size', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_bottle_size_label', type_='unique')
@@ -0,0 +1,26 @@
+"""token_blocklist created_at index
+
+Revision ID: e6b04c9f7a13
+Revises: a93d1e7b5f20
+Create Date: 2026-10-15 12:20:44.093518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b04c9f7a13'
+down_revision = 'a93d1e7b5f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('token_blocklist', schema=None) as batch_op:
+        batch_op.create_index('ix_token_blocklist_created_at', ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('token_blocklist', schema=None) as batch_op:
+        batch_op.drop_index('ix_token_blocklist_created_at')
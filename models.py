@@ -1,9 +1,47 @@
-from flask_sqlalchemy import SQLAlchemy
+from extensions import db
 from datetime import datetime, date
-import uuid
 from sqlalchemy import event , select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
-db = SQLAlchemy()
+
+# -----------------------------
+# Column types
+# -----------------------------
+# Money: fixed-point in the DB (exact SUMs), plain float in Python so the
+# existing route arithmetic keeps working unchanged.
+Money = db.Numeric(12, 2, asdecimal=False)
+
+
+# -----------------------------
+# Server-side defaults
+# -----------------------------
+class utcnow(FunctionElement):
+    """DB-side 'now' in UTC (DateTime columns are naive UTC)."""
+    type = db.DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"                        # SQLite: already UTC
+
+@compiles(utcnow, "postgresql")
+def _utcnow_pg(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"       # independent of server TimeZone
+
+class receipt_code(FunctionElement):
+    """DB-side fallback receipt number: 'R-' + 8 random hex chars."""
+    type = db.String()
+    inherit_cache = True
+
+@compiles(receipt_code)
+def _receipt_code_default(element, compiler, **kw):
+    return "('R-' || upper(hex(randomblob(4))))"
+
+@compiles(receipt_code, "postgresql")
+def _receipt_code_pg(element, compiler, **kw):
+    # gen_random_uuid(): core in PG13+, pgcrypto before that
+    return "('R-' || upper(substr(replace(gen_random_uuid()::text, '-', ''), 1, 8)))"
 
 # -----------------------------
 # 1. User (with roles)
@@ -22,7 +60,7 @@ class User(db.Model):
     allowed_user_agent = db.Column(db.String(255), nullable=True)
     device_approved = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=utcnow(), nullable=False)
 
     device_requests = db.relationship(
         "DeviceApprovalRequest",
@@ -45,11 +83,11 @@ class User(db.Model):
 class BottleSize(db.Model):
     __tablename__ = 'bottle_size'
     id = db.Column(db.Integer, primary_key=True)
-    label = db.Column(db.String(20), nullable=False)   # '500ml', '1.5L', '5L'
-    selling_price = db.Column(db.Float, nullable=False)
+    label = db.Column(db.String(20), nullable=False, unique=True)   # '500ml', '1.5L', '5L'
+    selling_price = db.Column(Money, nullable=False)
 
     # ✅ NEW: your manual all-in cost per carton (bottles, caps, labels, KRA, labor, etc.)
-    cost_price_carton = db.Column(db.Float, default=0.0)
+    cost_price_carton = db.Column(Money, default=0.0)
 
     stock_balance = db.relationship(
         "StockBalance",
@@ -106,16 +144,16 @@ class RetailSale(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     sale_type = db.Column(db.String(20), nullable=False, default="normal")  # normal, credit, dispatch
-    receipt_number = db.Column(db.String(50), unique=True, default=lambda: f"R-{uuid.uuid4().hex[:8].upper()}")
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    receipt_number = db.Column(db.String(50), unique=True, server_default=receipt_code())
+    date = db.Column(db.DateTime, server_default=utcnow())
 
     # Optional link to customer (required for credit sales)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=True)
     customer_name = db.Column(db.String(100), nullable=True)  # For walk-in customers
 
-    total_amount = db.Column(db.Float, default=0.0)
-    paid_amount = db.Column(db.Float, default=0.0)
-    balance_due = db.Column(db.Float, default=0.0)
+    total_amount = db.Column(Money, default=0.0)
+    paid_amount = db.Column(Money, default=0.0)
+    balance_due = db.Column(Money, default=0.0)
     payment_method = db.Column(db.String(50), nullable=True)  # Cash, M-PESA, Bank, etc.
     notes = db.Column(db.String(255), nullable=True)
     is_deleted = db.Column(db.Boolean, default=False)
@@ -124,7 +162,7 @@ class RetailSale(db.Model):
 
     # Relationships
     customer = db.relationship('Customer', back_populates='sales')
-    items = db.relationship('RetailSaleItem', back_populates='sale', cascade='all, delete-orphan')
+    items = db.relationship('RetailSaleItem', back_populates='sale', cascade='all, delete-orphan', lazy='selectin')
     payments = db.relationship('CustomerPayment', back_populates='retail_sale', cascade='all, delete-orphan')
 
     def __repr__(self):
@@ -141,15 +179,17 @@ class RetailSaleItem(db.Model):
     sale_id = db.Column(db.Integer, db.ForeignKey('retail_sale.id'), nullable=False)
     bottle_size_id = db.Column(db.Integer, db.ForeignKey('bottle_size.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)   # cartons
-    unit_price = db.Column(db.Float, nullable=False)
-    total_price = db.Column(db.Float, nullable=False)
+    unit_price = db.Column(Money, nullable=False)
+    total_price = db.Column(Money, nullable=False)
 
     # ✅ NEW: COGS snapshot at time of sale (per carton & line total)
-    cogs_unit_price = db.Column(db.Float)              # pulled from BottleSize.cost_price_carton
-    cogs_total = db.Column(db.Float)                   # cogs_unit_price * quantity
+    cogs_unit_price = db.Column(Money)              # pulled from BottleSize.cost_price_carton
+    cogs_total = db.Column(                         # maintained by the DB, never written from Python
+        Money, db.Computed("quantity * COALESCE(cogs_unit_price, 0)", persisted=True)
+    )
 
     sale = db.relationship('RetailSale', back_populates='items')
-    bottle_size = db.relationship('BottleSize')
+    bottle_size = db.relationship('BottleSize', lazy='joined')   # small dim table
 
 
     def __repr__(self):
@@ -157,27 +197,16 @@ class RetailSaleItem(db.Model):
     
 # models.py (bottom of file, after all model classes)
 
-# --- COGS auto-fill events (runs on ORM insert/update) ---
+# --- COGS auto-fill event (runs on ORM insert; cogs_total is a generated column) ---
 @event.listens_for(RetailSaleItem, "before_insert")
 def _fill_cogs_on_insert(mapper, connection, target: RetailSaleItem):
-    # If not provided by the route, take current BottleSize cost
+    # Fallback only: sale routes prefetch cogs_unit_price for all lines in one query
     if target.cogs_unit_price is None:
         bs_cost = connection.execute(
             select(BottleSize.cost_price_carton).where(BottleSize.id == target.bottle_size_id)
         ).scalar()
         target.cogs_unit_price = float(bs_cost or 0.0)
 
-    # Ensure cogs_total = quantity * cogs_unit_price
-    if target.cogs_total is None:
-        qty = int(target.quantity or 0)
-        target.cogs_total = float(target.cogs_unit_price or 0.0) * qty
-
-@event.listens_for(RetailSaleItem, "before_update")
-def _recalc_cogs_on_update(mapper, connection, target: RetailSaleItem):
-    qty = int(target.quantity or 0)
-    cup = float(target.cogs_unit_price or 0.0)
-    target.cogs_total = cup * qty
-
 
 
 # -----------------------------
@@ -188,9 +217,9 @@ class CustomerPayment(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     retail_sale_id = db.Column(db.Integer, db.ForeignKey('retail_sale.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     payment_method = db.Column(db.String(50), nullable=True)  # Cash, M-PESA, Bank
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.Column(db.DateTime, server_default=utcnow())
     added_by = db.Column(db.Integer, db.ForeignKey('users.id'))
 
     retail_sale = db.relationship('RetailSale', back_populates='payments')
@@ -212,7 +241,7 @@ class Expense(db.Model):
     date = db.Column(db.Date, default=date.today, index=True)  # ✅ index for fast range filters
     description = db.Column(db.String(255))
     category = db.Column(db.String(40))        # ✅ optional: 'Fuel', 'Power', 'Salaries', ...
-    amount = db.Column(db.Float)
+    amount = db.Column(Money)
     payment_method = db.Column(db.String(30))  # optional
     added_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     is_deleted = db.Column(db.Boolean, default=False)
@@ -257,7 +286,7 @@ class StockBalance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     bottle_size_id = db.Column(db.Integer, db.ForeignKey('bottle_size.id'), unique=True)
     quantity_available = db.Column(db.Integer, default=0)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, server_default=utcnow())
 
     bottle_size = db.relationship('BottleSize', back_populates='stock_balance')
 
@@ -271,7 +300,7 @@ class TokenBlockList(db.Model):
     __tablename__ = 'token_blocklist'
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, unique=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=utcnow(), nullable=False)
 
     def __repr__(self):
         return f"<TokenBlocklist id={self.id}, jti={self.jti}, created_at={self.created_at}>"
@@ -279,9 +308,39 @@ class TokenBlockList(db.Model):
 
 # bottom of models.py
 db.Index('ix_retail_sale_date', RetailSale.date)
-db.Index('ix_rsi_sale_id', RetailSaleItem.sale_id)
 db.Index('ix_rsi_bottle_size_id', RetailSaleItem.bottle_size_id)
 
+# Report filters: WHERE is_deleted = false AND date BETWEEN ... → index range scan
+db.Index('ix_retail_sale_active_date', RetailSale.is_deleted, RetailSale.date)
+db.Index('ix_expense_active_date', Expense.is_deleted, Expense.date)
+# Covers sale_id lookups too (leftmost prefix), so it replaces ix_rsi_sale_id
+db.Index('ix_rsi_sale_bottle', RetailSaleItem.sale_id, RetailSaleItem.bottle_size_id)
+# Range delete for `flask purge-blocklist` (rows older than the token lifetime)
+db.Index('ix_token_blocklist_created_at', TokenBlockList.created_at)
+# Pending device requests only (login closes a user's open requests; admins list them)
+db.Index(
+    'ix_device_approval_requests_pending',
+    DeviceApprovalRequest.user_id, DeviceApprovalRequest.created_at,
+    postgresql_where=DeviceApprovalRequest.is_resolved == False,  # noqa: E712
+    sqlite_where=DeviceApprovalRequest.is_resolved == False,  # noqa: E712
+)
+# Login looks users up by lower(email) (input is lowercased; stored case varies)
+db.Index('ix_users_email_lower', db.func.lower(User.email))
+# Packaging list: active rows in (date, id) order, optionally narrowed to one size
+# (the size-first one also answers bottle_size_in_use)
+db.Index(
+    'ix_packaging_entry_active_date',
+    PackagingEntry.date, PackagingEntry.id,
+    postgresql_where=PackagingEntry.is_deleted == False,  # noqa: E712
+    sqlite_where=PackagingEntry.is_deleted == False,  # noqa: E712
+)
+db.Index(
+    'ix_packaging_entry_active_size_date',
+    PackagingEntry.bottle_size_id, PackagingEntry.date, PackagingEntry.id,
+    postgresql_where=PackagingEntry.is_deleted == False,  # noqa: E712
+    sqlite_where=PackagingEntry.is_deleted == False,  # noqa: E712
+)
+
 
 
 
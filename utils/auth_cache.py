@@ -0,0 +1,132 @@
+# utils/auth_cache.py
+"""
+Two-tier cache for the JWT revocation check (see app.is_token_revoked).
+
+Both verdicts are cached:
+  L1: per-process TTLCaches keyed by jti (the short-lived "fine" one only when Redis is not configured)
+  L2: optional Redis (AUTH_CACHE_REDIS_URI, falls back to a redis:// RATELIMIT_STORAGE_URI)
+
+"Fine" (not revoked + user active) entries are tagged with a per-user epoch;
+bumping the epoch (deactivation) makes every cached entry for that user stale
+at once. "Revoked" never goes back, so logout (or a DB hit on the blocklist)
+marks the jti in L1 for AUTH_REVOKED_TTL seconds and sets auth:revoked:{jti}
+until the token's own expiry. With Redis a single MGET (ok, epoch, revoked)
+answers either way for every worker at once, and "fine" lives for AUTH_CACHE_TTL.
+
+Without Redis (the default, several gunicorn workers) forget()/invalidate_user()
+only reach the worker that ran them, so "fine" is kept in L1 for just
+AUTH_CACHE_LOCAL_TTL seconds. That is a deliberate trade-off: a logout handled
+by another worker may be honoured a few seconds late; deactivation is not, since
+app.load_user re-checks is_active on every request.
+"""
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+
+AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", "60"))
+# Per-process "fine" verdicts (no Redis): other workers can't invalidate them, keep short
+AUTH_CACHE_LOCAL_TTL: int = int(os.getenv("AUTH_CACHE_LOCAL_TTL", "3"))
+AUTH_CACHE_MAXSIZE: int = int(os.getenv("AUTH_CACHE_MAXSIZE", "100000"))
+AUTH_REVOKED_TTL: int = int(os.getenv("AUTH_REVOKED_TTL", "3600"))
+
+_redis_uri = (os.getenv("AUTH_CACHE_REDIS_URI") or os.getenv("RATELIMIT_STORAGE_URI") or "").strip()
+
+_l1: TTLCache = TTLCache(maxsize=AUTH_CACHE_MAXSIZE, ttl=AUTH_CACHE_LOCAL_TTL)
+_l1_revoked: TTLCache = TTLCache(maxsize=AUTH_CACHE_MAXSIZE, ttl=AUTH_REVOKED_TTL)
+_epochs: dict[int, int] = {}
+_lock = threading.Lock()
+
+_redis = None
+if _redis_uri.startswith(("redis://", "rediss://", "unix://")):
+    try:
+        import redis as _redis_lib
+        _redis = _redis_lib.Redis.from_url(_redis_uri, socket_timeout=0.2, socket_connect_timeout=0.2)
+    except Exception:
+        # No client library / bad URI → run with L1 only
+        _redis = None
+
+
+def _ok_key(jti: str) -> str:
+    return f"auth:ok:{jti}"
+
+def _epoch_key(user_id: int) -> str:
+    return f"auth:epoch:{user_id}"
+
+def _revoked_key(jti: str) -> str:
+    return f"auth:revoked:{jti}"
+
+
+def cached_verdict(jti: str | None, user_id: int | None) -> bool | None:
+    """
+    Cached answer for the revocation check: True = revoked, False = recently
+    verified fine for an active user, None = unknown (ask the DB).
+    """
+    if not jti or user_id is None:
+        return None
+
+    with _lock:
+        if jti in _l1_revoked:
+            return True
+        hit = _l1.get(jti) if _redis is None else None
+    if _redis is None:
+        return False if hit is not None and hit == (user_id, _epochs.get(user_id, 0)) else None
+
+    # Redis is shared by all workers, so it stays authoritative over L1
+    try:
+        ok, epoch, revoked = _redis.mget(_ok_key(jti), _epoch_key(user_id), _revoked_key(jti))
+    except Exception:
+        return None
+    if revoked is not None:
+        return True
+    return False if ok is not None and ok == (epoch or b"0") else None
+
+
+def remember_good(jti: str | None, user_id: int | None) -> None:
+    """Cache a fresh DB verdict of "token is fine" (Redis if configured, else briefly in L1)."""
+    if not jti or user_id is None:
+        return
+    if _redis is None:
+        with _lock:
+            _l1[jti] = (user_id, _epochs.get(user_id, 0))
+        return
+    try:
+        epoch = _redis.get(_epoch_key(user_id)) or b"0"
+        _redis.set(_ok_key(jti), epoch, ex=AUTH_CACHE_TTL)
+    except Exception:
+        pass
+
+
+def forget(jti: str | None, exp: int | None = None) -> None:
+    """Drop a token from both tiers and mark it revoked until `exp` (logout / blocklist hit)."""
+    if not jti:
+        return
+    with _lock:
+        _l1.pop(jti, None)
+        _l1_revoked[jti] = True
+    if _redis is None:
+        return
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.delete(_ok_key(jti))
+        ttl = int(exp - time.time()) if exp else 0
+        if ttl > 0:
+            pipe.setex(_revoked_key(jti), ttl, 1)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def invalidate_user(user_id: int | None) -> None:
+    """Bump the user's epoch so all cached tokens for them are re-checked (deactivation)."""
+    if user_id is None:
+        return
+    with _lock:
+        _epochs[user_id] = _epochs.get(user_id, 0) + 1
+    if _redis is None:
+        return
+    try:
+        _redis.incr(_epoch_key(user_id))
+    except Exception:
+        pass
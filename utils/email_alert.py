@@ -1,48 +1,118 @@
 # utils/email_alert.py
 from flask import current_app
 from flask_mail import Message
-from extensions import mail
-from models import User, db
-from flask_jwt_extended import get_jwt_identity
+from models import User
+from flask_jwt_extended import get_current_user
+from utils import email_worker
+from string import Template
 import os
 
+BUSINESS_NAME = os.getenv("BUSINESS_NAME", "Your Company")
+# "bcc": one message, server fans out  |  "individual": one message per admin, sent concurrently
+ADMIN_EMAIL_MODE = os.getenv("ADMIN_EMAIL_MODE", "bcc").strip().lower()
+
 # ---------- helpers ----------
 def _current_user():
     """Get the currently logged-in user from JWT (returns None if unavailable)."""
     try:
-        uid = get_jwt_identity()
-        if not uid:
-            return None
-        return db.session.get(User, uid)
+        return get_current_user()
     except Exception:
         return None
 
+def _build_message(subject: str, recipients: list[str], body: str, html: str | None = None,
+                   reply_to: str | None = None, sender: str | None = None,
+                   bcc: list[str] | None = None) -> Message:
+    msg = Message(subject=subject, recipients=recipients, body=body, sender=sender, bcc=bcc)
+    if html:
+        msg.html = html
+    if reply_to:
+        msg.reply_to = reply_to
+    return msg
+
+def _submit(msgs: list[Message], parallel: bool = False) -> bool:
+    """Hand prepared Messages to the background sender; True once queued."""
+    try:
+        return email_worker.enqueue(current_app._get_current_object(), msgs, parallel=parallel)
+    except Exception as e:
+        current_app.logger.error("Email send failed: %s", e)
+        return False
+
 def _send_email(subject: str, recipients: list[str], body: str, html: str | None = None,
                 reply_to: str | None = None, sender: str | None = None) -> bool:
     """
-    Centralized email sender. Returns True on success, False on any failure.
+    Centralized email sender. Builds the Message and hands it to the background
+    sender; returns True once queued, False if it could not be queued.
     Uses MAIL_DEFAULT_SENDER unless 'sender' override is provided.
     """
     if not recipients:
         return False
+    return _submit([_build_message(subject, recipients, body, html, reply_to, sender)])
 
-    try:
-        msg = Message(subject=subject, recipients=recipients, body=body, sender=sender)
-        if html:
-            msg.html = html
-        if reply_to:
-            msg.reply_to = reply_to
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"❌ Email send failed: {e}")
+def _send_email_many(subject: str, recipients: list[str], body: str, html: str | None = None,
+                     reply_to: str | None = None, sender: str | None = None,
+                     parallel: bool = False) -> bool:
+    """
+    Same content, one Message per recipient (nobody sees the others' addresses).
+    Delivered over one SMTP connection, or concurrently on one connection each
+    with parallel=True. Per-recipient failures are logged.
+    """
+    if not recipients:
         return False
+    msgs = [_build_message(subject, [r], body, html, reply_to, sender) for r in recipients]
+    return _submit(msgs, parallel=parallel)
+
+# ---------- templates (parsed once at import) ----------
+ADMIN_APPROVAL_TMPL = Template("""
+Hello,
+
+A login attempt from an unapproved device requires your authorization.
+
+👤 User: $name ($role)
+📍 IP Address: $ip
+🖥️ User-Agent: $agent
+
+${rid_line}Approval Code: $code
+
+Enter this code in the admin dashboard to approve the login.
+
+Thank you,
+Overall Admin Team
+""".strip())
+
+CREDIT_REPAYMENT_TMPL = Template("""
+Hello $name,
+
+We have received your payment for credit sale #$sale_id.
+
+💵 Amount Paid: $amount
+💳 Payment Method: $method
+📅 Date: $date
+💰 Remaining Balance: $balance
+
+Thank you for your payment.
+
+Best regards,
+$sender_name ($sender_role)
+$business
+""".strip())
+
+PAYMENT_RECEIPT_TMPL = Template("""
+Hello $name,
+
+We have received your payment for sale #$sale_id.
+
+💵 Amount Paid: $amount
+💰 Remaining Balance: $balance
+
+Thank you for your business.
+
+Regards,
+$business
+""".strip())
 
 # ---------- emails ----------
 def send_admin_approval_code(user, ip, agent, code, request_id=None):
     """Send approval code email to all overall admins (layout preserved)."""
-    print("📧 EMAIL FUNCTION TRIGGERED from send_admin_approval_code()")
-
     overall_admins = User.query.filter_by(
         role="admin", admin_level="overall", is_active=True
     ).all()
@@ -52,32 +122,27 @@ def send_admin_approval_code(user, ip, agent, code, request_id=None):
 
     subject = "Approval Code: New Device Login"
 
-    rid_line = f"🆔 Request ID: {request_id}\n" if request_id else ""
-
-    body = f"""
-Hello,
-
-A login attempt from an unapproved device requires your authorization.
-
-👤 User: {user.name} ({user.role})
-📍 IP Address: {ip}
-🖥️ User-Agent: {agent}
-
-{rid_line}Approval Code: {code}
-
-Enter this code in the admin dashboard to approve the login.
-
-Thank you,
-Overall Admin Team
-""".strip()
-
-    ok = True
-    for to in to_list:
-        if not _send_email(subject, [to], body):
-            ok = False
-            print(f"❌ Failed to send email to {to}")
+    body = ADMIN_APPROVAL_TMPL.substitute(
+        name=user.name,
+        role=user.role,
+        ip=ip,
+        agent=agent,
+        rid_line=f"🆔 Request ID: {request_id}\n" if request_id else "",
+        code=code,
+    )
+
+    if ADMIN_EMAIL_MODE == "individual":
+        # Per-admin messages (per-recipient success/failure in the logs), handshakes overlapped
+        ok = _send_email_many(subject, to_list, body, parallel=True)
+    else:
+        # Same body for every admin: one Message, the SMTP server fans out the BCC list.
+        # To: is the sender itself (an empty To: header gets mail penalized or refused).
+        sender = current_app.config.get("MAIL_DEFAULT_SENDER")
+        if sender:
+            ok = _submit([_build_message(subject, [sender], body, bcc=to_list)])
         else:
-            print(f"✅ Email sent to {to}")
+            ok = _send_email_many(subject, to_list, body, parallel=True)
+    current_app.logger.debug("Admin approval email to %s queued=%s", ", ".join(to_list), ok)
     return ok
 
 
@@ -87,35 +152,28 @@ def send_credit_repayment_email(customer, sale, payment):
     Includes the current user's name/role in the signature.
     """
     if not customer or not customer.email:
-        print("⚠️ Customer or customer email missing; skipping credit repayment email.")
+        current_app.logger.debug("Customer or customer email missing; skipping credit repayment email")
         return False
 
     sender = _current_user()
     sender_name = sender.name if sender else "System"
     sender_role = (sender.role.capitalize() if sender and sender.role else "Staff")
 
-    business = os.getenv("BUSINESS_NAME", "Your Company")
-
     subject = f"Payment Received — Receipt {sale.receipt_number or sale.id}"
-    body = f"""
-Hello {customer.name or 'Customer'},
-
-We have received your payment for credit sale #{sale.id}.
-
-💵 Amount Paid: {float(payment.amount or 0):.2f}
-💳 Payment Method: {payment.payment_method or '-'}
-📅 Date: {payment.date.strftime('%Y-%m-%d')}
-💰 Remaining Balance: {float(sale.balance_due or 0):.2f}
-
-Thank you for your payment.
-
-Best regards,
-{sender_name} ({sender_role})
-{business}
-""".strip()
+    body = CREDIT_REPAYMENT_TMPL.substitute(
+        name=customer.name or "Customer",
+        sale_id=sale.id,
+        amount=f"{float(payment.amount or 0):.2f}",
+        method=payment.payment_method or "-",
+        date=payment.date.strftime("%Y-%m-%d"),
+        balance=f"{float(sale.balance_due or 0):.2f}",
+        sender_name=sender_name,
+        sender_role=sender_role,
+        business=BUSINESS_NAME,
+    )
 
     ok = _send_email(subject, [customer.email], body)
-    print(f"{'✅' if ok else '❌'} Credit repayment email to {customer.email}")
+    current_app.logger.debug("Credit repayment email to %s queued=%s", customer.email, ok)
     return ok
 
 
@@ -124,26 +182,18 @@ def send_customer_payment_receipt(customer_name: str, customer_email: str, amoun
     Generic payment receipt (used by /send-payment-email route).
     """
     if not customer_email:
-        print("⚠️ No customer_email provided; skipping.")
+        current_app.logger.debug("No customer_email provided; skipping payment receipt")
         return False
 
-    business = os.getenv("BUSINESS_NAME", "Your Company")
-
     subject = f"Payment Receipt — Sale #{sale_id}"
-    body = f"""
-Hello {customer_name or 'Customer'},
-
-We have received your payment for sale #{sale_id}.
-
-💵 Amount Paid: {float(amount or 0):.2f}
-💰 Remaining Balance: {float(balance or 0):.2f}
-
-Thank you for your business.
-
-Regards,
-{business}
-""".strip()
+    body = PAYMENT_RECEIPT_TMPL.substitute(
+        name=customer_name or "Customer",
+        sale_id=sale_id,
+        amount=f"{float(amount or 0):.2f}",
+        balance=f"{float(balance or 0):.2f}",
+        business=BUSINESS_NAME,
+    )
 
     ok = _send_email(subject, [customer_email], body)
-    print(f"{'✅' if ok else '❌'} Payment receipt email to {customer_email}")
+    current_app.logger.debug("Payment receipt email to %s queued=%s", customer_email, ok)
     return ok
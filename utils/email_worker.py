@@ -0,0 +1,157 @@
+# utils/email_worker.py
+"""
+Background email sender: request handlers enqueue prepared Messages and return;
+one daemon thread drains the queue over a persistent SMTP session.
+
+The session is reused across batches and closed after EMAIL_IDLE_SECONDS without
+work (most servers drop idle clients anyway). A send that fails on a reused
+session is retried once on a fresh one, since the server may have hung up.
+Sends are paced to EMAIL_RATE_PER_MIN, and Flask-Mail recycles the session
+every MAIL_MAX_EMAILS messages (micro-batches), so bursts never trip
+provider throttling.
+"""
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from flask import current_app
+from flask_mail import BadHeaderError
+from extensions import mail
+
+EMAIL_IDLE_SECONDS: float = float(os.getenv("EMAIL_IDLE_SECONDS", "30"))
+EMAIL_PARALLEL_MAX: int = max(1, int(os.getenv("EMAIL_PARALLEL_MAX", "8")))
+# Provider-friendly pacing: at most N sends per rolling minute per process (0 = off)
+EMAIL_RATE_PER_MIN: int = int(os.getenv("EMAIL_RATE_PER_MIN", "30"))
+
+# Per-message refusals (bad address/headers, no sender): skip the message, keep the session
+_REJECTED = (
+    smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+    BadHeaderError, AssertionError,
+)
+
+_SENT_AT: deque = deque()          # monotonic timestamps of sends in the last minute
+_rate_lock = threading.Lock()
+
+_QUEUE: queue.Queue = queue.Queue()
+_thread: threading.Thread | None = None
+_start_lock = threading.Lock()
+
+
+def enqueue(app, msgs, parallel: bool = False) -> bool:
+    """
+    Queue Messages for delivery under `app`'s mail config; True once queued.
+    parallel=True sends each message on its own connection, up to
+    EMAIL_PARALLEL_MAX at a time (overlaps the handshakes; per-recipient logs).
+    """
+    _ensure_started()
+    _QUEUE.put((app, msgs, parallel))
+    return True
+
+
+def _ensure_started() -> None:
+    # Started lazily so it lives in the process that sends (post-fork under gunicorn)
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _start_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="email-worker", daemon=True)
+            _thread.start()
+
+
+def _open():
+    conn = mail.connect()
+    conn.__enter__()
+    return conn
+
+def _close(conn) -> None:
+    if conn is not None:
+        with suppress(Exception):
+            conn.__exit__(None, None, None)
+
+
+def _throttle() -> None:
+    """Sliding-window limiter: block until a send slot is free (never trips provider limits)."""
+    if EMAIL_RATE_PER_MIN <= 0:
+        return
+    while True:
+        with _rate_lock:
+            now = time.monotonic()
+            while _SENT_AT and now - _SENT_AT[0] >= 60:
+                _SENT_AT.popleft()
+            if len(_SENT_AT) < EMAIL_RATE_PER_MIN:
+                _SENT_AT.append(now)
+                return
+            wait = 60 - (now - _SENT_AT[0])
+        time.sleep(wait)
+
+
+def _run() -> None:
+    conn, conn_app = None, None
+    while True:
+        try:
+            app, msgs, parallel = _QUEUE.get(timeout=EMAIL_IDLE_SECONDS if conn is not None else None)
+        except queue.Empty:
+            _close(conn)
+            conn, conn_app = None, None
+            continue
+
+        if parallel:
+            _deliver_parallel(app, msgs)
+            continue
+
+        with app.app_context():
+            if conn is not None and conn_app is not app:
+                _close(conn)
+                conn = None
+            conn_app = app
+            conn, _ = _deliver(conn, msgs)
+
+
+def _deliver(conn, msgs):
+    """Send msgs, (re)connecting as needed; returns (connection to keep or None, all sent)."""
+    ok = True
+    for msg in msgs:
+        # One rate slot per message, taken before any connect: no session idles
+        # through the wait, and a retry doesn't spend a second slot
+        _throttle()
+        for attempt in (1, 2):
+            fresh = conn is None
+            try:
+                if fresh:
+                    conn = _open()
+                conn.send(msg)
+                break
+            except _REJECTED as e:
+                # This message was refused; the session itself is still usable
+                ok = False
+                current_app.logger.error("Failed to send email to %s: %s", ", ".join(msg.recipients), e)
+                break
+            except Exception as e:
+                _close(conn)
+                conn = None
+                if fresh or attempt == 2:
+                    ok = False
+                    current_app.logger.error("Email send failed: %s", e)
+                    break
+    return conn, ok
+
+
+def _deliver_one(app, msg) -> None:
+    with app.app_context():
+        conn, ok = _deliver(None, [msg])
+        _close(conn)
+        if ok:
+            current_app.logger.debug("Email sent to %s", ", ".join(msg.recipients))
+
+def _deliver_parallel(app, msgs) -> None:
+    """One connection per message, run concurrently; each thread gets its own app context."""
+    with ThreadPoolExecutor(max_workers=min(EMAIL_PARALLEL_MAX, len(msgs) or 1),
+                            thread_name_prefix="email-fanout") as ex:
+        for msg in msgs:
+            ex.submit(_deliver_one, app, msg)
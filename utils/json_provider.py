@@ -0,0 +1,48 @@
+# utils/json_provider.py
+"""
+orjson-backed JSON provider (app.json = OrjsonProvider(app)).
+
+Wire format stays what Flask's DefaultJSONProvider produces: sorted keys,
+non-str dict keys allowed, dates as HTTP dates, Decimal/UUID as strings,
+so clients see no difference, only cheaper encoding. That is also why
+views keep their explicit float()/isoformat() casts: orjson's native
+date/Decimal output would change the payloads.
+"""
+import dataclasses
+import decimal
+import typing as t
+import uuid
+from datetime import date
+
+import orjson
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _default(o: t.Any) -> t.Any:
+    # same fallbacks as flask.json.provider._default
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj: t.Any, **kwargs: t.Any) -> str:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+    def loads(self, s: str | bytes, **kwargs: t.Any) -> t.Any:
+        return orjson.loads(s)
+
+    def response(self, *args: t.Any, **kwargs: t.Any):
+        # jsonify(): hand orjson's bytes straight to the body (no str decode/re-encode)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_default, option=_OPTIONS),
+                                        mimetype="application/json")
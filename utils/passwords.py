@@ -0,0 +1,75 @@
+# utils/passwords.py
+"""
+One place for password hashing, so the scheme/cost is chosen by config, not per call site.
+
+New hashes use argon2id (argon2-cffi) unless PASSWORD_HASH_METHOD names a
+werkzeug method (e.g. "pbkdf2:sha256:1000" for cheap dev/test hashes) or
+argon2-cffi is not installed. Verification sniffs the stored hash, so legacy
+werkzeug rows keep working; login calls needs_rehash() and upgrades them.
+"""
+import os
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:
+    PasswordHasher = None
+
+PASSWORD_HASH_METHOD: str = os.getenv("PASSWORD_HASH_METHOD", "").strip()
+
+_ARGON2_PREFIX = "$argon2"
+_ph = None
+if PasswordHasher is not None and PASSWORD_HASH_METHOD in ("", "argon2"):
+    _ph = PasswordHasher(
+        time_cost=int(os.getenv("ARGON2_TIME_COST", "2")),
+        memory_cost=int(os.getenv("ARGON2_MEMORY_KIB", str(64 * 1024))),
+        parallelism=int(os.getenv("ARGON2_PARALLELISM", "2")),
+    )
+
+
+def hash_password(password: str) -> str:
+    if _ph is not None:
+        return _ph.hash(password)
+    if PASSWORD_HASH_METHOD and PASSWORD_HASH_METHOD != "argon2":
+        return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+    return generate_password_hash(password)
+
+
+def verify_password(stored_hash: str | None, password: str) -> bool:
+    """False for a missing/unreadable hash instead of raising."""
+    if not stored_hash or not password:
+        return False
+    if stored_hash.startswith(_ARGON2_PREFIX):
+        if PasswordHasher is None:
+            return False
+        try:
+            return (_ph or PasswordHasher()).verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(stored_hash, password)
+
+
+def needs_rehash(stored_hash: str | None) -> bool:
+    """True if a verified hash should be replaced with one from hash_password()."""
+    if _ph is None or not stored_hash:
+        return False
+    if not stored_hash.startswith(_ARGON2_PREFIX):
+        return True          # legacy werkzeug hash
+    try:
+        return _ph.check_needs_rehash(stored_hash)
+    except InvalidHashError:
+        return True
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    # Built on first use (not at import) with the same scheme/cost as real hashes
+    return hash_password(os.urandom(16).hex())
+
+
+def verify_nothing(password: str) -> None:
+    """Spend a real verify's time when there is no hash to check (missing user / no password)."""
+    verify_password(_dummy_hash(), password or "x")
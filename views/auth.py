@@ -1,16 +1,22 @@
 # views/auth.py  (or routes/auth.py)
 from __future__ import annotations
-from flask import Blueprint, request, jsonify
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, request, jsonify, current_app, g
 from flask_jwt_extended import (
-    create_access_token, jwt_required, get_jwt, get_jwt_identity
+    create_access_token, jwt_required, get_jwt, get_current_user as _jwt_user
 )
 from flask_jwt_extended.exceptions import NoAuthorizationError, JWTExtendedException
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import joinedload
 from models import db, User, TokenBlockList, DeviceApprovalRequest
-from app import limiter
+from extensions import limiter
+from utils import auth_cache
+from utils.passwords import hash_password, verify_password, verify_nothing, needs_rehash
 
+from collections import defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from random import randint
+import hmac
 import os
 import re
 
@@ -21,28 +27,48 @@ def _now_utc() -> datetime:
     # keep tz-naive UTC for consistency with your existing columns
     return datetime.utcnow()
 
+def _actor() -> User | None:
+    """The authenticated caller; loaded once per request by the JWT user loader (kept on g)."""
+    return _jwt_user()
+
 def _is_overall_admin(u: User | None) -> bool:
     return bool(u and u.role == "admin" and (u.admin_level or "").lower() == "overall")
 
+_TRUST_XFF = os.getenv("TRUST_XFF", "false").lower() == "true"
+_STRICT_IP = os.getenv("STRICT_DEVICE_IP", "false").lower() == "true"   # also pin approvals to the IP
+
 def _real_client_ip() -> str:
     """
     If you run behind Nginx/Cloudflare and use ProxyFix correctly, request.remote_addr
     should be the real client IP. If you *must* trust XFF, set TRUST_XFF=true in env.
+    Memoized on g: the login rate-limit keys and the view all ask for it.
     """
-    if os.getenv("TRUST_XFF", "false").lower() == "true":
-        xff = (request.headers.get("X-Forwarded-For") or "").split(",")[0].strip()
-        if xff:
-            return xff
-    ip = request.remote_addr or ""
+    ip = g.get("_client_ip")
+    if ip is not None:
+        return ip
+    ip = ""
+    if _TRUST_XFF:
+        ip = (request.headers.get("X-Forwarded-For") or "").partition(",")[0].strip()
+    if not ip:
+        ip = request.remote_addr or ""
     if not ip:
         route = request.access_route
         if route:
             ip = route[0]
+    g._client_ip = ip
     return ip
 
 # ---- User-Agent normalization (stable fingerprint) ---------------------------
-_UA_TOKEN_KEEP = re.compile(r"(windows|linux|android|iphone|ipad|macintosh|mac os x|x11|arm|x86_64|wow64|intel|chrome|edg|edge|safari|firefox|crios|fxios)")
-
+# Whole tokens kept after splitting (fullmatch of the old alternation == set membership)
+_UA_TOKEN_KEEP = frozenset((
+    "windows", "linux", "android", "iphone", "ipad", "macintosh", "x11", "arm", "x86_64",
+    "wow64", "intel", "chrome", "edg", "edge", "safari", "firefox", "crios", "fxios",
+))
+# Delimiter runs and version numbers, both blanked in one pass. \b is now evaluated
+# before "_" becomes a space, which only changes digit-only tokens (never kept).
+_UA_NOISE = re.compile(r"[()/_;:,]+|\b\d+(?:\.\d+)*\b")
+
+@lru_cache(maxsize=4096)   # keyed by the raw header; clients resend the same UA every login
 def _normalize_ua(ua_raw: str | None) -> str:
     """
     Convert noisy UA into a stable, version-agnostic fingerprint.
@@ -53,30 +79,33 @@ def _normalize_ua(ua_raw: str | None) -> str:
     if not ua_raw:
         return "unknown"
     ua = ua_raw.lower()
-    # replace delimiters with spaces
-    ua = re.sub(r"[()/_;:,]+", " ", ua)
-    # drop version numbers
-    ua = re.sub(r"\b\d+(\.\d+)*\b", " ", ua)
-    # keep only known platform/engine tokens
-    tokens = [t for t in ua.split() if _UA_TOKEN_KEEP.fullmatch(t)]
-    # dedupe in order
-    seen = set()
-    kept = []
-    for t in tokens:
-        if t not in seen:
-            kept.append(t)
-            seen.add(t)
+    # every kept token is a substring of the lowered UA: skip the regexes if none can be
+    if not any(k in ua for k in _UA_TOKEN_KEEP):
+        return "unknown"
+    # replace delimiters and version numbers with spaces
+    ua = _UA_NOISE.sub(" ", ua)
+    # keep only known platform/engine tokens, deduped in order
+    kept = dict.fromkeys(t for t in ua.split() if t in _UA_TOKEN_KEEP)
     return " ".join(kept) or "unknown"
 
-def _strict_ip_required() -> bool:
-    return os.getenv("STRICT_DEVICE_IP", "false").lower() == "true"
+# Approval routes read req.user right after loading req: fetch both in one SELECT
+_WITH_USER = (joinedload(DeviceApprovalRequest.user),)
 
+_PURGE_BATCH = max(1, int(os.getenv("DEVICE_PURGE_BATCH", "5000")))
+
+
+def _login_email() -> str:
+    """Rate-limit key part: the email being tried, normalized like login() does."""
+    data = request.get_json(silent=True) or {}
+    return str(data.get("email") or "").strip().lower()
 
 # ------------------------------ auth routes -----------------------------------
 
 # ✅ Login with rate-limit + no user enumeration + *stable* device approval flow
 @auth_bp.route("/login", methods=["POST"])
-@limiter.limit("5 per minute")
+@limiter.limit("5 per minute", key_func=lambda: f"{_login_email()}|{_real_client_ip()}")
+@limiter.limit("20 per hour", key_func=lambda: f"email:{_login_email()}")  # rotating IPs, one account
+@limiter.limit("30 per minute")                                           # one IP spraying many accounts
 def login():
     data = request.get_json(silent=True) or {}
     email = (data.get("email") or "").strip().lower()
@@ -86,19 +115,28 @@ def login():
         return jsonify({"error": "Email and password are required"}), 400
 
     try:
-        user = User.query.filter_by(email=email).first()
-
-        # generic on purpose: avoid user enumeration
-        if not user or not user.is_active:
+        # case-insensitive, served by ix_users_email_lower. That index is not unique,
+        # so if two accounts differ only by case pick deterministically: the exact
+        # (already-lowercase) spelling first, then the oldest account.
+        user = db.session.execute(
+            select(User)
+            .where(func.lower(User.email) == email)
+            .order_by((User.email == email).desc(), User.id)
+            .limit(1)
+        ).scalar_one_or_none()
+
+        # generic on purpose: avoid user enumeration (same answer *and* same hashing time)
+        if not user or not user.is_active or not user.password_hash:
+            verify_nothing(password)
             return jsonify({"error": "Invalid email or password"}), 401
 
-        if not user.password_hash or not check_password_hash(user.password_hash, password):
+        if not verify_password(user.password_hash, password):
             return jsonify({"error": "Invalid email or password"}), 401
 
-        # Collect client signals
-        user_ip_raw = _real_client_ip()
-        ua_raw = request.headers.get("User-Agent") or ""
-        ua_norm = _normalize_ua(ua_raw)
+        # upgrade legacy/outdated hashes in place (once per user)
+        if needs_rehash(user.password_hash):
+            user.password_hash = hash_password(password)
+            db.session.commit()
 
         # restricted roles must use device approval
         is_restricted = (
@@ -107,11 +145,15 @@ def login():
         )
 
         if is_restricted:
+            # Collect client signals (only restricted roles are device-checked)
+            user_ip_raw = _real_client_ip()
+            ua_norm = _normalize_ua(request.headers.get("User-Agent") or "")
+
             # MATCH RULE:
             # - UA must match normalized value we stored at approval time
             # - IP match is optional (default OFF); enable via STRICT_DEVICE_IP=true
             ua_ok = bool(user.device_approved and (user.allowed_user_agent or "") == ua_norm)
-            ip_ok = True if not _strict_ip_required() else (user.allowed_ip or "") == user_ip_raw
+            ip_ok = True if not _STRICT_IP else (user.allowed_ip or "") == user_ip_raw
             device_matches = ua_ok and ip_ok
 
             if not device_matches:
@@ -120,7 +162,6 @@ def login():
                     user_id=user.id,
                     is_resolved=False
                 ).update({DeviceApprovalRequest.is_resolved: True})
-                db.session.commit()
 
                 # Create a fresh approval request (store normalized UA for stability)
                 code = str(randint(100000, 999999))
@@ -132,14 +173,16 @@ def login():
                     expires_at=_now_utc() + timedelta(minutes=15)  # short TTL
                 )
                 db.session.add(req)
-                db.session.commit()
+                db.session.flush()               # assigns req.id inside the same transaction
+                req_id = req.id
+                db.session.commit()              # one commit for close-old + insert-new
 
                 return jsonify({
                     "error": "DEVICE_PENDING",
                     "message": "New device detected. Awaiting admin approval.",
                     "ip": user_ip_raw,
                     "user_agent": ua_norm,
-                    "request_id": req.id,
+                    "request_id": req_id,
                     "mode": "manual"
                 }), 403
 
@@ -157,8 +200,8 @@ def login():
             }
         }), 200
 
-    except Exception as e:
-        print("🔥 LOGIN ERROR:", str(e))
+    except Exception:
+        current_app.logger.exception("Login error")
         db.session.rollback()
         return jsonify({"error": "Internal server error"}), 500
 
@@ -168,10 +211,12 @@ def login():
 @jwt_required()
 def logout():
     try:
-        jti = get_jwt().get("jti")
+        claims = get_jwt()
+        jti = claims.get("jti")
         if jti:
             db.session.add(TokenBlockList(jti=jti, created_at=_now_utc()))
             db.session.commit()
+            auth_cache.forget(jti, claims.get("exp"))
         return jsonify({"message": "Successfully logged out"}), 200
     except Exception:
         db.session.rollback()
@@ -183,15 +228,10 @@ def logout():
 @limiter.limit("5 per minute")
 @jwt_required()
 def reset_password(user_id: int):
-    actor_id_raw = get_jwt_identity()
-    try:
-        actor_id = int(actor_id_raw)
-    except Exception:
-        return jsonify({"error": "Unauthorized"}), 401
-
-    actor = db.session.get(User, actor_id)
+    actor = _actor()
     if not actor:
         return jsonify({"error": "Unauthorized"}), 401
+    actor_id = actor.id
 
     data = request.get_json(silent=True) or {}
     new_password = data.get("new_password")
@@ -212,11 +252,11 @@ def reset_password(user_id: int):
 
     # if self-reset, require current password
     if is_self:
-        if not current_password or not check_password_hash(user.password_hash or "", current_password):
+        if not verify_password(user.password_hash, current_password):
             return jsonify({"error": "Current password is incorrect"}), 400
 
     try:
-        user.password_hash = generate_password_hash(new_password)
+        user.password_hash = hash_password(new_password)
         db.session.commit()
         return jsonify({"message": f"Password for {user.name} reset successfully"}), 200
     except Exception:
@@ -228,8 +268,7 @@ def reset_password(user_id: int):
 @jwt_required()
 def get_current_user():
     try:
-        user_id_raw = get_jwt_identity()
-        user = db.session.get(User, int(user_id_raw))
+        user = _actor()
         if not user:
             return jsonify({"error": "User not found"}), 404
 
@@ -252,8 +291,7 @@ def get_current_user():
 @jwt_required()
 def approve_device():
     try:
-        admin_id_raw = get_jwt_identity()
-        admin = db.session.get(User, int(admin_id_raw)) if admin_id_raw is not None else None
+        admin = _actor()
 
         if not _is_overall_admin(admin):
             return jsonify({"error": "Only overall admins can approve devices"}), 403
@@ -263,7 +301,7 @@ def approve_device():
         if not req_id:
             return jsonify({"error": "request_id is required"}), 400
 
-        req = db.session.get(DeviceApprovalRequest, int(req_id))
+        req = db.session.get(DeviceApprovalRequest, int(req_id), options=_WITH_USER)
         if not req or req.is_resolved:
             return jsonify({"error": "Request not found or already handled"}), 404
 
@@ -274,18 +312,19 @@ def approve_device():
         user = req.user
         # store normalized UA from the request; IP optional depending on STRICT_DEVICE_IP
         user.allowed_user_agent = req.user_agent            # normalized value
-        user.allowed_ip = req.ip_address if _strict_ip_required() else None
+        user.allowed_ip = req.ip_address if _STRICT_IP else None
         user.device_approved = True
         req.is_resolved = True
+        name = user.name                                    # read before commit expires it
 
         db.session.commit()
-        return jsonify({"message": f"{user.name}'s device approved manually"}), 200
+        return jsonify({"message": f"{name}'s device approved manually"}), 200
 
     except JWTExtendedException as e:
-        print("❌ JWT ERROR:", str(e))
+        current_app.logger.warning("JWT error: %s", e)
         return jsonify({"error": "JWT failed", "details": str(e)}), 401
     except Exception as e:
-        print("🔥 Unknown error:", str(e))
+        current_app.logger.exception("Device approval error")
         db.session.rollback()
         return jsonify({"error": "Internal error", "details": str(e)}), 500
 
@@ -296,8 +335,7 @@ def approve_device():
 @jwt_required()
 def approve_by_code():
     try:
-        admin_id_raw = get_jwt_identity()
-        admin = db.session.get(User, int(admin_id_raw)) if admin_id_raw is not None else None
+        admin = _actor()
 
         if not _is_overall_admin(admin):
             return jsonify({"error": "Only overall admins can approve devices"}), 403
@@ -309,24 +347,28 @@ def approve_by_code():
         if not code or not req_id:
             return jsonify({"error": "request_id and code are required"}), 400
 
-        req = db.session.get(DeviceApprovalRequest, int(req_id))
-        if not req or req.is_resolved or req.secret_code != code or _now_utc() > (req.expires_at or _now_utc()):
+        req = db.session.get(DeviceApprovalRequest, int(req_id), options=_WITH_USER)
+        if not req or req.is_resolved or _now_utc() > (req.expires_at or _now_utc()):
+            return jsonify({"error": "Invalid or expired code"}), 404
+        # constant-time compare: no prefix timing signal on the 6-digit code
+        if not hmac.compare_digest((req.secret_code or "").encode(), code.encode()):
             return jsonify({"error": "Invalid or expired code"}), 404
 
         user = req.user
         user.allowed_user_agent = req.user_agent            # normalized value
-        user.allowed_ip = req.ip_address if _strict_ip_required() else None
+        user.allowed_ip = req.ip_address if _STRICT_IP else None
         user.device_approved = True
         req.is_resolved = True
+        name = user.name                                    # read before commit expires it
         db.session.commit()
 
-        return jsonify({"message": f"{user.name}'s device approved"}), 200
+        return jsonify({"message": f"{name}'s device approved"}), 200
 
     except JWTExtendedException as e:
-        print("❌ JWT ERROR:", str(e))
+        current_app.logger.warning("JWT error: %s", e)
         return jsonify({"error": "JWT failed", "details": str(e)}), 401
     except Exception as e:
-        print("🔥 Unknown error:", str(e))
+        current_app.logger.exception("Device approval error")
         db.session.rollback()
         return jsonify({"error": "Internal error", "details": str(e)}), 500
 
@@ -336,17 +378,19 @@ def approve_by_code():
 @limiter.limit("10 per minute")
 @jwt_required()
 def get_device_requests():
-    current_user = db.session.get(User, int(get_jwt_identity()))
+    current_user = _actor()
     if not _is_overall_admin(current_user):
         return jsonify({"error": "Unauthorized"}), 403
 
-    requests = DeviceApprovalRequest.query.filter_by(is_resolved=False)\
+    # user joined in the same SELECT (no per-row user lookup)
+    requests = DeviceApprovalRequest.query.options(joinedload(DeviceApprovalRequest.user))\
+        .filter_by(is_resolved=False)\
         .order_by(DeviceApprovalRequest.created_at.desc()).all()
     return jsonify([
         {
             "id": r.id,
             "user": r.user.name,
-            "user_id": r.user.id,
+            "user_id": r.user_id,
             "ip": r.ip_address,
             "user_agent": r.user_agent,   # already normalized
             "created_at": (r.created_at or _now_utc()).isoformat()
@@ -359,7 +403,7 @@ def get_device_requests():
 @limiter.limit("10 per minute")
 @jwt_required()
 def reject_device(req_id: int):
-    admin = db.session.get(User, int(get_jwt_identity()))
+    admin = _actor()
     if not _is_overall_admin(admin):
         return jsonify({"error": "Only overall admins can reject"}), 403
 
@@ -381,21 +425,22 @@ def reject_device(req_id: int):
 @limiter.limit("20 per minute")
 @jwt_required()
 def device_summary():
-    current_user = db.session.get(User, int(get_jwt_identity()))
+    current_user = _actor()
     if not _is_overall_admin(current_user):
         return jsonify({"error": "Unauthorized"}), 403
 
-    approved_devices = db.session.query(
-        DeviceApprovalRequest.user_id,
-        DeviceApprovalRequest.ip_address,
-        DeviceApprovalRequest.user_agent
-    ).filter(DeviceApprovalRequest.is_resolved.is_(True)).all()
+    approved_devices = db.session.execute(
+        select(
+            DeviceApprovalRequest.user_id,
+            DeviceApprovalRequest.ip_address,
+            DeviceApprovalRequest.user_agent
+        ).where(DeviceApprovalRequest.is_resolved.is_(True))
+    )
 
-    summary: dict[str, list[str]] = {}
+    # rows streamed straight from the cursor; no intermediate list
+    summary: defaultdict[str, list[str]] = defaultdict(list)
     for user_id, ip, agent in approved_devices:
-        key = str(user_id)
-        label = f"{ip or '—'} | {agent}"
-        summary.setdefault(key, []).append(label)
+        summary[str(user_id)].append(f"{ip or '—'} | {agent}")
 
     return jsonify(summary), 200
 
@@ -405,7 +450,7 @@ def device_summary():
 @limiter.limit("5 per minute")
 @jwt_required()
 def delete_device_summary():
-    admin = db.session.get(User, int(get_jwt_identity()))
+    admin = _actor()
     if not _is_overall_admin(admin):
         return jsonify({"error": "Unauthorized"}), 403
 
@@ -450,8 +495,16 @@ def delete_device_summary():
         if only_resolved:
             q = q.filter(DeviceApprovalRequest.is_resolved.is_(True))
 
-    deleted = q.delete(synchronize_session=False)
-    db.session.commit()
+    # Delete in committed batches: bounded lock scope / WAL per statement on big purges
+    batch = select(q.with_entities(DeviceApprovalRequest.id).limit(_PURGE_BATCH).subquery().c.id)
+    stmt = delete(DeviceApprovalRequest).where(DeviceApprovalRequest.id.in_(batch))
+    deleted = 0
+    while True:
+        n = db.session.execute(stmt, execution_options={"synchronize_session": False}).rowcount
+        db.session.commit()
+        deleted += n
+        if n < _PURGE_BATCH:
+            break
     return jsonify({"ok": True, "deleted": int(deleted)}), 200
 
 
@@ -1,8 +1,11 @@
 # routes/packaging.py
-from flask import Blueprint, request, jsonify
+import base64
+import orjson
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, date, timezone
-from sqlalchemy import func, select
+from datetime import datetime, date, timedelta, timezone
+from sqlalchemy import and_, exists, func, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
 from models import db, PackagingEntry, BottleSize, StockBalance, User
 from zoneinfo import ZoneInfo
 
@@ -11,6 +14,10 @@ packaging_bp = Blueprint("packaging_bp", __name__)
 # ---- Time / TZ (store UTC, display Africa/Nairobi +03:00) --------------------
 TZ_KE = ZoneInfo("Africa/Nairobi")
 UTC = timezone.utc
+# tzdata has Nairobi on a constant +03:00 (no DST) since 1942, long before any
+# stored row: the fixed offset serializes identically to TZ_KE and skips
+# ZoneInfo's transition lookup per row. Also used by views/sale.py.
+TZ_KE_FIXED = timezone(timedelta(hours=3))
 
 def _now_utc() -> datetime:
     """Aware UTC now for DB DateTime fields."""
@@ -27,7 +34,7 @@ def iso_ke(dt: datetime | None) -> str | None:
         return None
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=UTC)
-    return dt.astimezone(TZ_KE).isoformat()
+    return dt.astimezone(TZ_KE_FIXED).isoformat()
 
 # --- Carton pack sizes (for derived bottles only) ---
 PACK_SIZES = {
@@ -42,14 +49,59 @@ PACK_SIZES = {
 def parse_date(s):
     if not s:
         return None
+    # Canonical YYYY-MM-DD takes the C fast path; strptime keeps accepting
+    # the looser forms it always did (e.g. 2024-1-5)
+    if len(s) == 10 and s[4] == "-" and s[7] == "-":
+        try:
+            return date.fromisoformat(s)
+        except ValueError:
+            pass
     try:
         return datetime.strptime(s, "%Y-%m-%d").date()
     except ValueError:
         return None
 
-def current_user():
-    uid = get_jwt_identity()
-    return db.session.get(User, uid)
+_TRUTHY = frozenset({"true", "1", "yes", "y", "t"})
+
+def _arg_true(name: str) -> bool:
+    """Boolean query flag (?x=true|1|yes|y|t, any case); absent means False."""
+    val = request.args.get(name)
+    return val is not None and val.lower() in _TRUTHY
+
+def encode_cursor(entry) -> str:
+    """
+    Opaque keyset cursor for list_packaging: urlsafe base64 of "YYYY-MM-DD,id"
+    ("" for the date part when the entry's date is NULL; the column is nullable).
+    """
+    raw = f"{entry.date.isoformat() if entry.date else ''},{entry.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(s):
+    """(date or None, id) from encode_cursor(), or None if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(s + "=" * (-len(s) % 4)).decode()
+        d, i = raw.split(",", 1)
+        return (date.fromisoformat(d) if d else None), int(i)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def _seek_after(key, ascending: bool):
+    """
+    WHERE clause for rows after cursor `key` under ORDER BY date, id (both asc or
+    both desc). A row-value compare never matches NULL dates, so those are
+    handled explicitly, following where the dialect sorts NULLs: PostgreSQL
+    treats them as larger than any date, SQLite as smaller.
+    """
+    d, i = key
+    nulls_large = db.session.get_bind().dialect.name == "postgresql"
+    nulls_last = nulls_large if ascending else not nulls_large
+    id_after = PackagingEntry.id > i if ascending else PackagingEntry.id < i
+    if d is None:
+        cond = and_(PackagingEntry.date.is_(None), id_after)
+        return cond if nulls_last else or_(cond, PackagingEntry.date.isnot(None))
+    row_key = tuple_(PackagingEntry.date, PackagingEntry.id)
+    cond = row_key > (d, i) if ascending else row_key < (d, i)
+    return or_(cond, PackagingEntry.date.is_(None)) if nulls_last else cond
 
 def entry_or_404(entry_id, include_deleted=False):
     entry = db.session.get(PackagingEntry, entry_id)
@@ -93,55 +145,101 @@ def to_bs_dict(bs: BottleSize):
         "carton_label": f"{bs.label} x {per or '?'}",
     }
 
-def to_entry_dict(e: PackagingEntry):
-    label = getattr(e.bottle_size, "label", None)
+def _entry_dict(e: PackagingEntry, label, added_by_name):
     per_carton = pack_size_for_label(label) or 0
-    cartons = int(e.quantity or 0)  # quantity == cartons
-    bottles = cartons * per_carton
+    cartons = e.quantity or 0  # quantity == cartons (Integer column)
     return {
         "id": e.id,
         "date": e.date.isoformat() if e.date else None,
         "bottle_size_id": e.bottle_size_id,
         "bottle_size_label": label,
         "cartons": cartons,
-        "bottles": bottles,
+        "bottles": cartons * per_carton,
         "units_per_carton": per_carton,
         "added_by": e.added_by,
-        "added_by_name": getattr(e.added_by_user, "name", None),
+        "added_by_name": added_by_name,
         "is_deleted": e.is_deleted,
     }
 
-def get_or_create_stock_balance(size_id: int) -> StockBalance:
-    sb = db.session.execute(
-        select(StockBalance).where(StockBalance.bottle_size_id == size_id)
-    ).scalar_one_or_none()
-    if not sb:
-        sb = StockBalance(
-            bottle_size_id=size_id,
-            quantity_available=0,
-            updated_at=_now_utc(),
-        )
-        db.session.add(sb)
-        db.session.flush()
-    return sb
+def to_entry_dict(e: PackagingEntry):
+    return _entry_dict(e, getattr(e.bottle_size, "label", None), getattr(e.added_by_user, "name", None))
+
+def to_entry_dicts(entries):
+    """
+    List version of to_entry_dict: labels/names come from two narrow
+    (id, label) / (id, name) SELECTs into plain dicts, so no related ORM
+    objects are loaded and serialization is dict lookups only.
+    """
+    size_ids = {e.bottle_size_id for e in entries if e.bottle_size_id is not None}
+    user_ids = {e.added_by for e in entries if e.added_by is not None}
+    labels = dict(db.session.execute(
+        select(BottleSize.id, BottleSize.label).where(BottleSize.id.in_(size_ids))
+    ).all()) if size_ids else {}
+    names = dict(db.session.execute(
+        select(User.id, User.name).where(User.id.in_(user_ids))
+    ).all()) if user_ids else {}
+    return [_entry_dict(e, labels.get(e.bottle_size_id), names.get(e.added_by)) for e in entries]
+
+def _upsert(model):
+    """Dialect INSERT with ON CONFLICT support (PostgreSQL / SQLite)."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
 
 def adjust_stock(size_id: int, delta_cartons: int):
-    """Increment (or decrement) stock balance in CARTONS for a bottle size."""
-    sb = get_or_create_stock_balance(size_id)
-    new_qty = int(sb.quantity_available or 0) + int(delta_cartons)
-    if new_qty < 0:
-        raise ValueError("Stock would go negative; operation aborted.")
-    sb.quantity_available = new_qty
-    sb.updated_at = _now_utc()
+    """
+    Increment (or decrement) stock balance in CARTONS for a bottle size.
+    A result below zero raises ValueError (callers roll back).
+    """
+    adjust_stock_many({size_id: delta_cartons})
+
+def adjust_stock_many(deltas: dict[int, int],
+                      error: str = "Stock would go negative; operation aborted."):
+    """
+    Apply {bottle_size_id: delta_cartons} with one multi-row
+    INSERT ... ON CONFLICT DO UPDATE ... RETURNING: missing rows are created,
+    existing ones incremented, all atomically in one round-trip. Zero deltas
+    are skipped. Any balance below zero (including a new row created with a
+    negative delta) raises ValueError(error.format(size_id=...)); callers roll back.
+    Shared with views/sale.py, which passes its own error wording.
+    """
+    deltas = {int(k): int(v) for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    now = _now_utc()
+    ins = _upsert(StockBalance).values([
+        {"bottle_size_id": size_id, "quantity_available": delta, "updated_at": now}
+        for size_id, delta in sorted(deltas.items())        # stable row-lock order
+    ])
+    rows = db.session.execute(
+        ins.on_conflict_do_update(
+            index_elements=[StockBalance.bottle_size_id],
+            set_={
+                "quantity_available": func.coalesce(StockBalance.quantity_available, 0)
+                + ins.excluded.quantity_available,
+                "updated_at": now,
+            },
+        ).returning(StockBalance.bottle_size_id, StockBalance.quantity_available)
+    ).all()
+    for size_id, qty in sorted(rows):
+        if qty < 0:
+            raise ValueError(error.format(size_id=size_id))
 
 def bottle_size_in_use(size_id: int) -> bool:
-    ref = db.session.query(PackagingEntry.id).filter_by(bottle_size_id=size_id, is_deleted=False).first()
-    return ref is not None
+    return db.session.scalar(select(exists().where(
+        PackagingEntry.bottle_size_id == size_id,
+        PackagingEntry.is_deleted == False,  # noqa: E712
+    )))
 
 # ================= Misc/Health ==============
+# Constant body, encoded once (same bytes jsonify would produce)
+_HEALTH_BODY = orjson.dumps({"ok": True, "message": "packaging routes live"}, option=orjson.OPT_SORT_KEYS)
+
 @packaging_bp.route("/packaging/health", methods=["GET"])
 def packaging_health():
-    return jsonify({"ok": True, "message": "packaging routes live"}), 200
+    return current_app.response_class(_HEALTH_BODY, mimetype="application/json")
 
 # =====================================================
 # ================ BottleSize (no pagination) =========
@@ -162,13 +260,14 @@ def create_bottle_size():
     if cost_price is None:
         cost_price = 0.0  # default if not provided
 
-    exists = db.session.query(BottleSize.id).filter(BottleSize.label == label).first()
-    if exists:
-        return jsonify({"ok": False, "error": "A bottle size with this label already exists."}), 409
-
+    # bottle_size.label is UNIQUE: let the INSERT be the check
     bs = BottleSize(label=label, selling_price=price, cost_price_carton=cost_price)
     db.session.add(bs)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "A bottle size with this label already exists."}), 409
     return jsonify({"ok": True, "message": "Created", "data": to_bs_dict(bs)}), 201
 
 @packaging_bp.route("/bottle-sizes", methods=["GET"])
@@ -205,12 +304,7 @@ def update_bottle_size(size_id):
         new_label = (data.get("label") or "").strip()
         if not new_label:
             return jsonify({"ok": False, "error": "label cannot be empty"}), 400
-        exists = db.session.query(BottleSize.id).filter(
-            BottleSize.label == new_label, BottleSize.id != size_id
-        ).first()
-        if exists:
-            return jsonify({"ok": False, "error": "A bottle size with this label already exists."}), 409
-        bs.label = new_label
+        bs.label = new_label   # uniqueness enforced by the constraint at commit
 
     # --- Update selling price ---
     if "selling_price" in data:
@@ -226,7 +320,11 @@ def update_bottle_size(size_id):
             return jsonify({"ok": False, "error": "cost_price_carton must be a number >= 0"}), 400
         bs.cost_price_carton = cost_price
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "A bottle size with this label already exists."}), 409
     return jsonify({"ok": True, "message": "Updated", "data": to_bs_dict(bs)}), 200
 
 @packaging_bp.route("/bottle-sizes/<int:size_id>", methods=["DELETE"])
@@ -299,16 +397,16 @@ def create_packaging():
     if date_str and d is None:
         return jsonify({"ok": False, "error": "date must be in YYYY-MM-DD format"}), 400
 
-    user = current_user()
-    if not user:
-        return jsonify({"ok": False, "error": "User not found"}), 401
+    # The token's subject is the user id; @jwt_required() has already rejected
+    # unknown and deactivated users (app.load_user) before the view runs
+    uid = int(get_jwt_identity())
 
     try:
         entry = PackagingEntry(
             date=d,
             bottle_size_id=bs.id,
             quantity=cartons,  # quantity = cartons
-            added_by=user.id,
+            added_by=uid,
             is_deleted=False,
         )
         db.session.add(entry)
@@ -327,15 +425,18 @@ def list_packaging():
     """
     Query:
       page, per_page, bottle_size_id, date_from, date_to,
-      include_deleted ('true'|'false'), order ('asc'|'desc' by date)
+      include_deleted ('true'|'false'), order ('asc'|'desc' by date),
+      after (keyset cursor from pagination.next_cursor; replaces page),
+      with_total (true|1|yes: also COUNT(*) for pagination.total/pages, else those are null)
     """
     page = max(1, int(request.args.get("page", 1)))
     per_page = min(100, max(1, int(request.args.get("per_page", 20))))
     bottle_size_id = request.args.get("bottle_size_id", type=int)
     date_from = parse_date(request.args.get("date_from"))
     date_to = parse_date(request.args.get("date_to"))
-    include_deleted = request.args.get("include_deleted", "false").lower() == "true"
+    include_deleted = _arg_true("include_deleted")
     order = request.args.get("order", "desc")
+    with_total = _arg_true("with_total")
 
     stmt = select(PackagingEntry)
     if not include_deleted:
@@ -351,27 +452,55 @@ def list_packaging():
     else:
         stmt = stmt.order_by(PackagingEntry.date.desc(), PackagingEntry.id.desc())
 
-    paginated = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
-    items = [to_entry_dict(e) for e in paginated.items]
+    after = request.args.get("after")
+    if after:
+        # Keyset page: seek past (date, id) on the active_date index; no OFFSET, no COUNT(*)
+        key = decode_cursor(after)
+        if key is None:
+            return jsonify({"ok": False, "error": "after must be a cursor from pagination.next_cursor"}), 400
+        stmt = stmt.where(_seek_after(key, order == "asc"))
+        rows = db.session.scalars(stmt.limit(per_page + 1)).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        return jsonify({
+            "ok": True,
+            "data": to_entry_dicts(rows),
+            "pagination": {
+                "per_page": per_page,
+                "has_next": has_next,
+                "next_cursor": encode_cursor(rows[-1]) if has_next else None,
+            }
+        }), 200
+
+    if with_total:
+        paginated = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
+        rows, total, pages, has_next = paginated.items, paginated.total, paginated.pages, paginated.has_next
+    else:
+        # One extra row answers "is there a next page?" without a COUNT(*)
+        rows = db.session.scalars(stmt.limit(per_page + 1).offset((page - 1) * per_page)).all()
+        has_next = len(rows) > per_page
+        rows, total, pages = rows[:per_page], None, None
+
     return jsonify({
         "ok": True,
-        "data": items,
+        "data": to_entry_dicts(rows),
         "pagination": {
-            "page": paginated.page,
-            "per_page": paginated.per_page,
-            "total": paginated.total,
-            "pages": paginated.pages,
-            "has_next": paginated.has_next,
-            "has_prev": paginated.has_prev,
-            "next_page": paginated.next_num,
-            "prev_page": paginated.prev_num,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "pages": pages,
+            "has_next": has_next,
+            "has_prev": page > 1,
+            "next_page": page + 1 if has_next else None,
+            "prev_page": page - 1 if page > 1 else None,
+            "next_cursor": encode_cursor(rows[-1]) if has_next else None,
         }
     }), 200
 
 @packaging_bp.route("/packaging/<int:entry_id>", methods=["GET"])
 @jwt_required()
 def get_packaging(entry_id):
-    include_deleted = request.args.get("include_deleted", "false").lower() == "true"
+    include_deleted = _arg_true("include_deleted")
     entry, err, code = entry_or_404(entry_id, include_deleted)
     if err:
         return err, code
@@ -441,8 +570,8 @@ def update_packaging(entry_id):
 
     try:
         if new_size_id != old_size_id:
-            adjust_stock(old_size_id, -old_cartons)   # reverse old
-            adjust_stock(new_size_id, +new_cartons)   # apply new
+            # reverse old + apply new in one statement
+            adjust_stock_many({old_size_id: -old_cartons, new_size_id: +new_cartons})
             entry.bottle_size_id = new_size_id
             entry.quantity = new_cartons
         else:
@@ -508,38 +637,26 @@ def restore_packaging(entry_id):
 @packaging_bp.route("/stock-balances", methods=["GET"])
 @jwt_required()
 def stock_balances():
-    sizes = {s.id: s for s in db.session.execute(select(BottleSize)).scalars().all()}
-    balances = db.session.execute(select(StockBalance)).scalars().all()
+    # One round trip: every size with its balance row, if it has one yet
+    rows = db.session.execute(
+        select(BottleSize, StockBalance)
+        .outerjoin(StockBalance, StockBalance.bottle_size_id == BottleSize.id)
+    ).all()
 
     data = []
-    for sb in balances:
-        bs = sizes.get(sb.bottle_size_id)
-        label = bs.label if bs else None
-        per = pack_size_for_label(label) or 0
-        cartons = int(sb.quantity_available or 0)
+    for bs, sb in rows:
+        per = pack_size_for_label(bs.label) or 0
+        cartons = int(sb.quantity_available or 0) if sb else 0
         data.append({
-            "bottle_size_id": sb.bottle_size_id,
-            "label": label,
+            "bottle_size_id": bs.id,
+            "label": bs.label,
             "cartons_on_hand": cartons,
             "bottles_on_hand": cartons * per,
             "units_per_carton": per,
-            "carton_price": float(bs.selling_price) if bs and bs.selling_price is not None else None,
-            "updated_at": iso_ke(sb.updated_at) if sb.updated_at else None,
+            "carton_price": float(bs.selling_price) if bs.selling_price is not None else None,
+            "updated_at": iso_ke(sb.updated_at) if sb and sb.updated_at else None,
         })
 
-    # Include sizes without a StockBalance row yet
-    for sid, bs in sizes.items():
-        if not any(row["bottle_size_id"] == sid for row in data):
-            per = pack_size_for_label(bs.label) or 0
-            data.append({
-                "bottle_size_id": sid,
-                "label": bs.label,
-                "cartons_on_hand": 0,
-                "bottles_on_hand": 0,
-                "units_per_carton": per,
-                "carton_price": float(bs.selling_price) if bs.selling_price is not None else None,
-                "updated_at": None,
-            })
-
+    # sorted here, not in SQL: keeps Python string order whatever the DB collation
     data.sort(key=lambda x: x["label"] or "")
     return jsonify({"ok": True, "data": data}), 200
@@ -1,35 +1,26 @@
-from flask import Blueprint, request, jsonify, Response, send_file, current_app
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import select, func, or_, case
+from flask import Blueprint, request, jsonify, Response, send_file, current_app, stream_with_context
+from flask_jwt_extended import jwt_required, get_current_user
+from sqlalchemy import select, func, or_
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload, lazyload, raiseload
 from datetime import datetime, date, timedelta, timezone
 from zoneinfo import ZoneInfo
-import csv, io, os
+import csv, hashlib, io, os
 import tempfile
 from collections import defaultdict
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import (
-    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage, PageBreak
-)
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-
-from utils.printer import print_sale_80mm
+# matplotlib / reportlab / escpos are imported inside the PDF + print routes:
+# they cost ~0.5 s at import and only those endpoints need them.
 from contextlib import suppress
 
+from utils.email_alert import send_customer_payment_receipt
+from views.packaging import TZ_KE_FIXED, adjust_stock_many
+
 from models import (
     db,
     RetailSale,
     RetailSaleItem,
     CustomerPayment,
     BottleSize,
-    StockBalance,
-    User,
     Customer,
     Expense,
 )
@@ -55,7 +46,7 @@ def iso_ke(dt):
         return None
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=UTC)
-    return dt.astimezone(TZ_KE).isoformat()
+    return dt.astimezone(TZ_KE_FIXED).isoformat()
 
 def _ke_bounds_utc(d: date):
     """
@@ -87,8 +78,15 @@ BUSINESS_PHONE = os.environ.get("BUSINESS_PHONE", "+254 202 447 447")
 BUSINESS_EMAIL = os.environ.get("BUSINESS_EMAIL", "blueskydrinkingwater@gmail.com")
 P_O_BOX = os.environ.get("P_O_BOX", "P.O.Box 101-70100, Garissa")
 
+# CSV export streaming: ORM rows per fetch / bytes per flushed chunk
+CSV_YIELD_PER = 1000
+CSV_CHUNK_BYTES = 64 * 1024
+
 def _parse_date(s):
     if not s: return None
+    if len(s) == 10 and s[4] == "-" and s[7] == "-":
+        try: return date.fromisoformat(s)     # C fast path for the canonical form
+        except ValueError: pass
     for fmt in ("%Y-%m-%d", "%Y/%m/%d"):
         try: return datetime.strptime(s, fmt).date()
         except ValueError: pass
@@ -147,7 +145,50 @@ def _apply_filters_items_q(q):
     )
     return q, date_from, date_to
 
+# Rendered report charts, keyed by a hash of what they plot: the same totals
+# (e.g. today's report re-downloaded) reuse the PNGs and skip matplotlib entirely.
+# Default location is <instance_path>/chart-cache; CHART_CACHE_DIR overrides it.
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR")
+CHART_CACHE_MAX_FILES = int(os.getenv("CHART_CACHE_MAX_FILES", "200"))
+_chart_dir: str | None = None
+
+def _chart_cache_dir() -> str:
+    """
+    The cache directory, created 0700 on first use. Cached PNGs end up embedded
+    in reports, so a directory another user owns or can write to is not trusted:
+    fall back to a private mkdtemp() for this process instead.
+    """
+    global _chart_dir
+    if _chart_dir is not None:
+        return _chart_dir
+    d = CHART_CACHE_DIR or os.path.join(current_app.instance_path, "chart-cache")
+    try:
+        os.makedirs(d, mode=0o700, exist_ok=True)
+        st = os.stat(d)
+        if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+            raise PermissionError(f"{d} is not private to this user")
+    except OSError as e:
+        current_app.logger.warning("Chart cache dir unusable (%s); using a private temp dir", e)
+        d = tempfile.mkdtemp(prefix="chart-cache-")
+    _chart_dir = d
+    return d
+
+def _chart_cache_evict(cache_dir: str):
+    """Drop least-recently-used PNGs (by mtime; hits touch theirs) beyond CHART_CACHE_MAX_FILES."""
+    with suppress(OSError):
+        entries = [e for e in os.scandir(cache_dir) if e.name.endswith(".png")]
+        if len(entries) <= CHART_CACHE_MAX_FILES:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for e in entries[:len(entries) - CHART_CACHE_MAX_FILES]:
+            with suppress(OSError):
+                os.unlink(e.path)
+
 def _chart_paths_from_bottle_totals(bottle_totals: dict[str, dict]):
+    """
+    (bar_path, pie_path) PNGs for the report. Files live in the chart cache dir
+    and are shared between requests: callers must not delete them.
+    """
     labels = []
     cartons = []
     values = []
@@ -158,22 +199,54 @@ def _chart_paths_from_bottle_totals(bottle_totals: dict[str, dict]):
     if not labels:
         labels = ["No Data"]; cartons = [0]; values = [0.0]
 
-    bar_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    bar_path = bar_tmp.name; bar_tmp.close()
-    plt.figure(); plt.bar(labels, cartons); plt.xticks(rotation=30, ha="right")
-    plt.title("Cartons per Bottle Size"); plt.xlabel("Bottle Size"); plt.ylabel("Cartons"); plt.tight_layout()
-    plt.savefig(bar_path, dpi=150); plt.close()
+    key = hashlib.blake2b(repr((labels, cartons, values)).encode(), digest_size=16).hexdigest()
+    cache_dir = _chart_cache_dir()
+    bar_path = os.path.join(cache_dir, f"{key}_bar.png")
+    pie_path = os.path.join(cache_dir, f"{key}_pie.png")
+    if os.path.exists(bar_path) and os.path.exists(pie_path):
+        for p in (bar_path, pie_path):
+            with suppress(OSError):
+                os.utime(p)
+        return bar_path, pie_path
+
+    # Standalone Figure + Agg canvas: no pyplot import, no global figure
+    # registry/state shared between request threads
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    def _save(fig, path):
+        # Render beside the target, then rename: readers never see a partial PNG
+        fd, tmp = tempfile.mkstemp(suffix=".png", dir=cache_dir)
+        os.close(fd)
+        try:
+            FigureCanvasAgg(fig)
+            fig.savefig(tmp, dpi=150)
+            os.replace(tmp, path)
+        finally:
+            with suppress(OSError):
+                os.unlink(tmp)
+
+    fig = Figure(); ax = fig.add_subplot()
+    ax.bar(labels, cartons)
+    for t in ax.get_xticklabels():
+        t.set_rotation(30); t.set_horizontalalignment("right")
+    ax.set_title("Cartons per Bottle Size"); ax.set_xlabel("Bottle Size"); ax.set_ylabel("Cartons"); fig.tight_layout()
+    _save(fig, bar_path)
 
-    pie_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    pie_path = pie_tmp.name; pie_tmp.close()
     total_value = sum(values)
     sizes = values if total_value > 0 else [1 for _ in labels]
-    plt.figure(); plt.pie(sizes, labels=labels, autopct="%1.1f%%"); plt.title("Revenue Share per Bottle Size")
-    plt.tight_layout(); plt.savefig(pie_path, dpi=150); plt.close()
+    fig = Figure(); ax = fig.add_subplot()
+    ax.pie(sizes, labels=labels, autopct="%1.1f%%"); ax.set_title("Revenue Share per Bottle Size")
+    fig.tight_layout()
+    _save(fig, pie_path)
 
+    _chart_cache_evict(cache_dir)
     return bar_path, pie_path
 
 def _charts_row(bar_path, pie_path):
+    from reportlab.platypus import Table, TableStyle, Paragraph, Image as RLImage
+    from reportlab.lib.styles import getSampleStyleSheet
+
     cells = []
     if os.path.exists(bar_path):
         cells.append(RLImage(bar_path, width=250, height=170))
@@ -208,30 +281,13 @@ def _to_float_nonneg(x):
     except (TypeError, ValueError): return None
     return v if v >= 0 else None
 
-def _current_user():
-    uid = get_jwt_identity()
-    return db.session.get(User, uid)
-
 def _units_per_carton(label):
     if not label: return None
     return PACK_SIZES.get(label) or PACK_SIZES.get(str(label).lower())
 
-def _get_or_create_stock(size_id: int) -> StockBalance:
-    sb = db.session.execute(
-        select(StockBalance).where(StockBalance.bottle_size_id == size_id)
-    ).scalar_one_or_none()
-    if not sb:
-        sb = StockBalance(bottle_size_id=size_id, quantity_available=0, updated_at=_now_utc())
-        db.session.add(sb); db.session.flush()
-    return sb
-
-def _adjust_stock(size_id: int, delta_cartons: int):
-    sb = _get_or_create_stock(size_id)
-    new_qty = int(sb.quantity_available or 0) + int(delta_cartons)
-    if new_qty < 0:
-        raise ValueError(f"Insufficient stock for size_id={size_id}")
-    sb.quantity_available = new_qty
-    sb.updated_at = _now_utc()
+def _adjust_stock_many(deltas: dict[int, int]):
+    """Stock moves for sales: packaging's bulk upsert, with the sales error wording."""
+    adjust_stock_many(deltas, error="Insufficient stock for size_id={size_id}")
 
 def _to_item_dict(it: RetailSaleItem):
     bs = it.bottle_size
@@ -255,6 +311,13 @@ def _to_payment_dict(p: CustomerPayment):
         "added_by": p.added_by,
     }
 
+# Everything _to_sale_dict() touches, batched: items (+ their bottle_size) and
+# payments each come in one SELECT ... IN per page instead of one per sale
+SALE_LOAD_OPTIONS = (
+    selectinload(RetailSale.items).joinedload(RetailSaleItem.bottle_size),
+    selectinload(RetailSale.payments),
+)
+
 def _to_sale_dict(s: RetailSale, include_items: bool = True, include_payments: bool = True):
     data = {
         "id": s.id,
@@ -281,6 +344,13 @@ def _calc_totals_with_default_price(items):
     if not items:
         raise ValueError("items cannot be empty")
 
+    # Default prices for every item that needs one, in one SELECT ... IN
+    wanted = {_to_int_nonneg(it.get("bottle_size_id")) for it in items if it.get("unit_price") is None}
+    wanted.discard(None)
+    prices = dict(db.session.execute(
+        select(BottleSize.id, BottleSize.selling_price).where(BottleSize.id.in_(wanted))
+    ).all()) if wanted else {}
+
     total_amount = 0.0
     normalized = []
     for idx, it in enumerate(items, start=1):
@@ -295,9 +365,9 @@ def _calc_totals_with_default_price(items):
 
         unit_price = it.get("unit_price")
         if unit_price is None:
-            bs = BottleSize.query.get(bs_id)
-            if not bs: raise ValueError(f"Item #{idx}: BottleSize {bs_id} not found")
-            unit_price = float(bs.selling_price)
+            price = prices.get(_to_int_nonneg(bs_id))
+            if price is None: raise ValueError(f"Item #{idx}: BottleSize {bs_id} not found")
+            unit_price = float(price)
         else:
             try: unit_price = float(unit_price)
             except Exception: raise ValueError(f"Item #{idx}: unit_price must be numeric")
@@ -312,17 +382,23 @@ def _calc_totals_with_default_price(items):
         })
     return total_amount, normalized
 
+def _cogs_unit_prices(size_ids) -> dict[int, float]:
+    """Current cost_price_carton per size in one SELECT (saves the per-row lookup in before_insert)."""
+    ids = {int(i) for i in size_ids}
+    if not ids:
+        return {}
+    rows = db.session.execute(
+        select(BottleSize.id, BottleSize.cost_price_carton).where(BottleSize.id.in_(ids))
+    ).all()
+    return {bid: float(cost or 0.0) for bid, cost in rows}
+
 def _apply_stock_delta(old_items, new_items):
-    from collections import defaultdict
-    agg_old = defaultdict(int); agg_new = defaultdict(int)
+    deltas = defaultdict(int)
     for it in old_items or []:
-        agg_old[it.bottle_size_id] += int(it.quantity or 0)
+        deltas[it.bottle_size_id] += int(it.quantity or 0)
     for it in new_items or []:
-        agg_new[it["bottle_size_id"]] += int(it["quantity"] or 0)
-    for size_id in set(agg_old.keys()) | set(agg_new.keys()):
-        delta = agg_new[size_id] - agg_old[size_id]
-        if delta != 0:
-            _adjust_stock(size_id, -delta)
+        deltas[it["bottle_size_id"]] -= int(it["quantity"] or 0)
+    _adjust_stock_many(deltas)
 
 def generate_receipt_number(seq_width: int = SEQ_WIDTH) -> str:
     # Prefix on KE local date to reflect business day (UTC+03:00)
@@ -371,7 +447,7 @@ def _to_customer_dict(cust):
 @jwt_required()
 def create_customer():
     data = request.get_json(silent=True) or {}
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
     try:
@@ -386,7 +462,7 @@ def create_customer():
 @retail_bp.route("/customers", methods=["GET"])
 @jwt_required()
 def get_customers():
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -401,28 +477,34 @@ def get_customers():
         .subquery()
     )
 
-    rows = (
-        db.session.query(
-            Customer,
+    # Plain column rows (no Customer objects / identity map) → dicts directly
+    rows = db.session.execute(
+        select(
+            Customer.id, Customer.name, Customer.phone, Customer.email, Customer.created_at,
             func.coalesce(balances_subq.c.balance_due, 0.0).label("balance_due"),
         )
         .outerjoin(balances_subq, Customer.id == balances_subq.c.cid)
         .order_by(Customer.name.asc())
-        .all()
-    )
+    ).all()
 
-    data = []
-    for c, bal in rows:
-        d = _to_customer_dict(c)
-        d["total_balance_due"] = float(bal or 0.0)
-        d["has_balance"] = (bal or 0.0) > 0
-        data.append(d)
+    data = [
+        {
+            "id": cid,
+            "name": name,
+            "phone": phone,
+            "email": email,
+            "created_at": iso_ke(created_at),
+            "total_balance_due": float(bal or 0.0),
+            "has_balance": (bal or 0.0) > 0,
+        }
+        for cid, name, phone, email, created_at, bal in rows
+    ]
     return jsonify({"ok": True, "data": data}), 200
 
 @retail_bp.route("/customers/<int:customer_id>", methods=["PUT", "PATCH"])
 @jwt_required()
 def update_customer(customer_id):
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -445,7 +527,7 @@ def update_customer(customer_id):
 @retail_bp.route("/customers/<int:customer_id>", methods=["DELETE"])
 @jwt_required()
 def delete_customer(customer_id):
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -466,7 +548,7 @@ def delete_customer(customer_id):
 @jwt_required()
 def create_retail_sale():
     data = request.get_json(silent=True) or {}
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -511,14 +593,20 @@ def create_retail_sale():
         return jsonify({"ok": False, "error": "Could not allocate receipt number, please retry"}), 409
 
     try:
+        deltas = defaultdict(int)
+        for it in normalized_items:
+            deltas[it["bottle_size_id"]] -= it["quantity"]
+        _adjust_stock_many(deltas)
+
+        cogs = _cogs_unit_prices(deltas)
         for it in normalized_items:
-            _adjust_stock(it["bottle_size_id"], -it["quantity"])
             db.session.add(RetailSaleItem(
                 sale_id=sale.id,
                 bottle_size_id=it["bottle_size_id"],
                 quantity=it["quantity"],
                 unit_price=it["unit_price"],
                 total_price=it["total_price"],
+                cogs_unit_price=cogs.get(it["bottle_size_id"], 0.0),
             ))
         db.session.commit()
         return jsonify({"ok": True, "message": "Sale created (unpaid)", "data": _to_sale_dict(sale)}), 201
@@ -560,6 +648,11 @@ def list_retail_sales():
     stmt = stmt.order_by(
         RetailSale.date.asc() if order == "asc" else RetailSale.date.desc(),
         RetailSale.id.desc()
+    ).options(
+        # items aren't serialized here: skip the mapper's lazy='selectin' load
+        # (and raise if someone starts touching them without loading)
+        raiseload(RetailSale.items),
+        selectinload(RetailSale.payments),
     )
     paged = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
 
@@ -624,7 +717,7 @@ def get_yesterdays_sales():
         RetailSale.date >= start_utc,
         RetailSale.date < end_utc,
         RetailSale.is_deleted == False
-    ).order_by(RetailSale.date.asc(), RetailSale.id.asc()).all()
+    ).order_by(RetailSale.date.asc(), RetailSale.id.asc()).options(*SALE_LOAD_OPTIONS).all()
     return jsonify({
         "ok": True,
         "date": y_ke.isoformat(),
@@ -645,7 +738,7 @@ def get_last_7_days_sales():
         RetailSale.date >= start_utc,
         RetailSale.date < end_utc,
         RetailSale.is_deleted == False
-    ).order_by(RetailSale.date.asc(), RetailSale.id.asc()).all()
+    ).order_by(RetailSale.date.asc(), RetailSale.id.asc()).options(*SALE_LOAD_OPTIONS).all()
 
     return jsonify({
         "ok": True,
@@ -666,6 +759,7 @@ def list_today_sales():
         .where(RetailSale.date >= start_utc)
         .where(RetailSale.date < end_utc)
         .order_by(RetailSale.date.desc(), RetailSale.id.desc())  # ✅ stable, newest first
+        .options(*SALE_LOAD_OPTIONS)
     )
     sales = db.session.scalars(stmt).all()
     return jsonify({"ok": True, "data": [_to_sale_dict(s) for s in sales]}), 200
@@ -712,6 +806,7 @@ def update_retail_sale(sale_id):
             old_items = list(sale.items)
             _apply_stock_delta(old_items, normalized_items)
             for it in old_items: db.session.delete(it)
+            cogs = _cogs_unit_prices(ni["bottle_size_id"] for ni in normalized_items)
             for ni in normalized_items:
                 db.session.add(RetailSaleItem(
                     sale_id=sale.id,
@@ -719,6 +814,7 @@ def update_retail_sale(sale_id):
                     quantity=ni["quantity"],
                     unit_price=ni["unit_price"],
                     total_price=ni["total_price"],
+                    cogs_unit_price=cogs.get(ni["bottle_size_id"], 0.0),
                 ))
             sale.total_amount = total_amount
             sale.balance_due = max(0.0, sale.total_amount - (sale.paid_amount or 0))
@@ -738,8 +834,10 @@ def delete_retail_sale(sale_id):
     if not sale or sale.is_deleted:
         return jsonify({"ok": False, "error": "RetailSale not found or already deleted"}), 404
     try:
+        deltas = defaultdict(int)
         for it in sale.items:
-            _adjust_stock(it.bottle_size_id, +int(it.quantity or 0))
+            deltas[it.bottle_size_id] += int(it.quantity or 0)
+        _adjust_stock_many(deltas)
         sale.is_deleted = True
         db.session.commit()
         return jsonify({"ok": True, "message": "Deleted"}), 200
@@ -759,8 +857,10 @@ def restore_retail_sale(sale_id):
     if not sale.is_deleted:
         return jsonify({"ok": True, "message": "Already active"}), 200
     try:
+        deltas = defaultdict(int)
         for it in sale.items:
-            _adjust_stock(it.bottle_size_id, -int(it.quantity or 0))
+            deltas[it.bottle_size_id] -= int(it.quantity or 0)
+        _adjust_stock_many(deltas)
         sale.is_deleted = False
         db.session.commit()
         return jsonify({"ok": True, "message": "Restored", "data": _to_sale_dict(sale)}), 200
@@ -864,6 +964,10 @@ def search_retail_sales():
     stmt = stmt.order_by(
         RetailSale.date.asc() if order == "asc" else RetailSale.date.desc(),
         RetailSale.id.desc()
+    ).options(
+        selectinload(RetailSale.items).joinedload(RetailSaleItem.bottle_size)
+        if include_items else lazyload(RetailSale.items),
+        selectinload(RetailSale.payments),
     )
     paged = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
 
@@ -896,41 +1000,57 @@ def export_retail_sales_csv():
         stmt = stmt.where(RetailSale.date >= start_utc)
     if end_utc:
         stmt = stmt.where(RetailSale.date < end_utc)
-    stmt = stmt.order_by(RetailSale.date.asc(), RetailSale.id.asc())
-    sales = db.session.scalars(stmt).all()
-
-    from io import StringIO
-    si = StringIO()
-    writer = csv.writer(si)
-
-    if include_items:
-        writer.writerow(["Receipt", "Date", "Customer", "Sale Type", "Bottle Size", "Quantity", "Unit Price", "Total Price"])
-        for sale in sales:
-            for item in sale.items:
+    stmt = stmt.order_by(RetailSale.date.asc(), RetailSale.id.asc()).options(
+        selectinload(RetailSale.items).joinedload(RetailSaleItem.bottle_size)
+        if include_items else lazyload(RetailSale.items)
+    )
+    stmt = stmt.execution_options(yield_per=CSV_YIELD_PER)
+
+    def generate():
+        # Rows are fetched yield_per at a time and flushed in ~64 KiB chunks:
+        # memory stays flat however many sales the range covers
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        def drain():
+            chunk = buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+            return chunk
+
+        if include_items:
+            writer.writerow(["Receipt", "Date", "Customer", "Sale Type", "Bottle Size", "Quantity", "Unit Price", "Total Price"])
+        else:
+            writer.writerow(["Receipt", "Date", "Customer", "Sale Type", "Total Amount", "Paid Amount", "Balance Due"])
+
+        for sale in db.session.scalars(stmt):
+            if include_items:
+                for item in sale.items:
+                    writer.writerow([
+                        sale.receipt_number,
+                        iso_ke(sale.date)[:10],  # YYYY-MM-DD in KE (+03:00 normalized)
+                        sale.customer_name or "",
+                        sale.sale_type,
+                        item.bottle_size.label if item.bottle_size else "",
+                        item.quantity,
+                        item.unit_price,
+                        item.total_price
+                    ])
+            else:
                 writer.writerow([
                     sale.receipt_number,
-                    iso_ke(sale.date)[:10],  # YYYY-MM-DD in KE (+03:00 normalized)
+                    iso_ke(sale.date)[:10],
                     sale.customer_name or "",
                     sale.sale_type,
-                    item.bottle_size.label if item.bottle_size else "",
-                    item.quantity,
-                    item.unit_price,
-                    item.total_price
+                    sale.total_amount,
+                    sale.paid_amount,
+                    sale.balance_due
                 ])
-    else:
-        writer.writerow(["Receipt", "Date", "Customer", "Sale Type", "Total Amount", "Paid Amount", "Balance Due"])
-        for sale in sales:
-            writer.writerow([
-                sale.receipt_number,
-                iso_ke(sale.date)[:10],
-                sale.customer_name or "",
-                sale.sale_type,
-                sale.total_amount,
-                sale.paid_amount,
-                sale.balance_due
-            ])
-
-    output = Response(si.getvalue(), mimetype="text/csv")
+            if buf.tell() >= CSV_CHUNK_BYTES:
+                yield drain()
+        yield drain()
+
+    output = Response(stream_with_context(generate()), mimetype="text/csv")
     output.headers["Content-Disposition"] = "attachment; filename=retail_sales.csv"
     return output
 
@@ -966,7 +1086,7 @@ def create_payment_for_sale(sale_id):
     else:
         date_utc = _now_utc()
 
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -1024,7 +1144,7 @@ def create_payment_for_credit_sale(sale_id):
     else:
         dts = _now_utc()
 
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -1198,17 +1318,18 @@ def close_dispatch(sale_id):
 
     try:
         new_total = 0.0
+        returned = defaultdict(int)
         for it in sale.items:
             sent = int(it.quantity or 0)
             ret = int(rmap.get(it.bottle_size_id, 0) or 0)
             if ret < 0 or ret > sent:
                 return jsonify({"ok": False, "error": f"Invalid return qty for bottle_size_id={it.bottle_size_id}"}), 400
-            if ret:
-                _adjust_stock(it.bottle_size_id, +ret)
+            returned[it.bottle_size_id] += ret
             sold = sent - ret
             it.quantity = sold
             it.total_price = float(it.unit_price or 0.0) * int(sold)
             new_total += it.total_price
+        _adjust_stock_many(returned)
 
         sale.total_amount = float(new_total)
         sale.balance_due = max(0.0, float(sale.total_amount) - float(sale.paid_amount or 0.0))
@@ -1218,7 +1339,7 @@ def close_dispatch(sale_id):
             if amount_paid > remaining + 1e-9:
                 return jsonify({"ok": False, "error": f"amount_paid exceeds remaining balance ({remaining:.2f})"}), 400
 
-            user = _current_user()
+            user = get_current_user()
             if not user:
                 return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -1617,6 +1738,10 @@ def summary_cogs_last7():
 
 # ---------------- Header block for PDF (place above the route) ----------------
 def _header_table(styles, date_from, date_to):
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import Table, TableStyle, Paragraph, Image as RLImage
+
     business_name_style = ParagraphStyle(
         name="BusinessName",
         parent=styles["Normal"],
@@ -1673,6 +1798,11 @@ def _header_table(styles, date_from, date_to):
 @retail_bp.route("/retail-sales/export-items.pdf", methods=["GET"])
 @jwt_required()
 def export_sales_items_pdf():
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet
+
     q = _sales_items_query()
     q, date_from, date_to = _apply_filters_items_q(q)
     rows = q.all()
@@ -1819,9 +1949,6 @@ def export_sales_items_pdf():
     # Build PDF
     doc.build(elems)
     buf.seek(0)
-    for p in (bar_path, pie_path):
-        with suppress(Exception):
-            os.unlink(p)
 
     return send_file(
         buf,
@@ -1984,7 +2111,7 @@ def create_expense():
         return jsonify({"ok": False, "error": f"payment_method must be one of: {', '.join(sorted(ALLOWED_PAY_METHODS))}"}), 400
 
     category = (data.get("category") or "").strip() or None
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
@@ -2126,7 +2253,7 @@ def delete_expense(expense_id):
     finally:
         db.session.close()
 
-# add near _current_user()
+# add near the other helpers
 def _user_display_name(u):
     if not u:
         return "—"
@@ -2139,13 +2266,14 @@ def _user_display_name(u):
 @retail_bp.route("/retail-sales/<int:sale_id>/print", methods=["POST"])
 @jwt_required()
 def print_sale_receipt(sale_id):
+    from utils.printer import print_sale_80mm
+
     sale = db.session.get(RetailSale, sale_id)
     if not sale or getattr(sale, "is_deleted", False):
         return jsonify({"ok": False, "error": "RetailSale not found"}), 404
 
     try:
-        uid = get_jwt_identity()
-        user = db.session.get(User, uid) if uid else None
+        user = get_current_user()
     except Exception:
         user = None
 
@@ -2214,7 +2342,7 @@ def create_cogs():
     if payment_method not in ALLOWED_PAY_METHODS:
         return jsonify({"ok": False, "error": f"payment_method must be one of: {', '.join(sorted(ALLOWED_PAY_METHODS))}"}), 400
 
-    user = _current_user()
+    user = get_current_user()
     if not user:
         return jsonify({"ok": False, "error": "User not found"}), 401
 
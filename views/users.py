@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash
 from models import db, User
+from utils import auth_cache
+from utils.passwords import hash_password
 from datetime import datetime
 
 user_bp = Blueprint("user_bp", __name__)
@@ -31,7 +32,7 @@ def create_user():
     user = User(
         name=name,
         email=email,
-        password_hash=generate_password_hash(password) if password else None,
+        password_hash=hash_password(password) if password else None,
         role=role,
         admin_level=admin_level,
         phone=phone,
@@ -105,7 +106,7 @@ def update_user(user_id):
     user.name = data.get("name", user.name)
     user.email = data.get("email", user.email)
     if data.get("password"):
-        user.password_hash = generate_password_hash(data["password"])
+        user.password_hash = hash_password(data["password"])
     user.role = data.get("role", user.role)
     user.admin_level = data.get("admin_level", user.admin_level)
     user.phone = data.get("phone", user.phone)
@@ -118,6 +119,8 @@ def update_user(user_id):
         user.is_active = bool(data["is_active"])
 
     db.session.commit()
+    if not user.is_active:
+        auth_cache.invalidate_user(user.id)
     return jsonify({"message": "User updated successfully"}), 200
 
 
@@ -129,6 +132,7 @@ def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     user.is_active = False
     db.session.commit()
+    auth_cache.invalidate_user(user.id)
     return jsonify({"message": "User deactivated (soft delete)"}), 200
 
 # DELETE USER